@@ -0,0 +1,105 @@
+"""
+Benchmarks DiscrimIndex against scanning every member, as the discrim commands
+used to, on synthetic member sets
+
+    python -m benchmarks.discrims [--sizes 10000,100000,1000000] [--seed N]
+
+For each size it reports how long building the index takes and the memory it
+holds, the latency of a lookup with the index and with a scan, and how many
+member updates the index can apply per second.
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from turbo.index import DiscrimIndex
+
+
+class Member:
+
+    __slots__ = ('name', 'discriminator')
+
+    def __init__(self, name, discriminator):
+        self.name = name
+        self.discriminator = discriminator
+
+
+def members(size, rng):
+    """
+    Returns size members with a realistic spread of names
+    Popular names are shared by many users, so most discriminators have a few
+    names used many times and a long tail of unique ones
+    """
+    common = ['user{}'.format(i) for i in range(max(10, size // 100))]
+    result = []
+    for i in range(size):
+        if rng.random() < 0.3:
+            name = common[int(len(common) * rng.random() ** 3)]
+        else:
+            name = 'name{}'.format(i)
+        result.append(Member(name, '{:04}'.format(rng.randint(1, 9999))))
+    return result
+
+
+def scan(all_members, discrim):
+    """The lookup the discrim command did before the index"""
+    return set([m.name for m in all_members if m.discriminator == discrim])
+
+
+def timed(func, args_list):
+    """Returns the average seconds func took over every args in args_list"""
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - start) / len(args_list)
+
+
+def run(size, rng, lookups):
+    population = members(size, rng)
+    discrims = ['{:04}'.format(rng.randint(1, 9999)) for _ in range(lookups)]
+
+    index = DiscrimIndex()
+    start = time.perf_counter()
+    index.build(population)
+    build = time.perf_counter() - start
+    # Built again while tracing, as tracing slows it down
+    tracemalloc.start()
+    index.build(population)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert set(index.get(discrims[0])) == scan(population, discrims[0])
+    indexed = timed(lambda d: list(index.get(d)), [(d,) for d in discrims])
+    # Scans are slow on large sets, so fewer are run
+    scanned = timed(scan, [(population, d) for d in discrims[:max(3, lookups * 1000 // size)]])
+
+    changes = [(population[rng.randrange(size)], Member('renamed{}'.format(i), '0001'))
+               for i in range(min(size, 100000))]
+    start = time.perf_counter()
+    for before, after in changes:
+        index.update(before, after)
+    updates = len(changes) / (time.perf_counter() - start)
+
+    return build, memory, indexed, scanned, updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the discriminator index")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="comma separated member counts")
+    parser.add_argument('--lookups', type=int, default=1000, help="lookups timed with the index")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print("{:>10}{:>12}{:>14}{:>16}{:>14}{:>10}{:>14}".format(
+        'Members', 'Build (ms)', 'Memory (MiB)', 'Lookup (us)', 'Scan (ms)', 'Speedup', 'Updates/s'))
+    for size in (int(s) for s in args.sizes.split(',')):
+        build, memory, indexed, scanned, updates = run(size, random.Random(args.seed), args.lookups)
+        print("{:>10}{:>12.1f}{:>14.1f}{:>16.2f}{:>14.2f}{:>9.0f}x{:>14.0f}".format(
+            size, build * 1000, memory / 1024 / 1024, indexed * 10 ** 6, scanned * 1000,
+            scanned / indexed if indexed else 0, updates))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Benchmarks how fast a command message is resolved to a handler call, with the
+command registry and with the lookup the bot did before it
+
+    python -m benchmarks.dispatch [--messages N] [--seed N]
+
+Only finding the handler and building its arguments is timed, the handlers are
+not run. The old path is kept here as it was in Turbo.on_message: getattr on the
+commands object, a loop over the aliases file and inspect.signature per message.
+Both paths get the same stream of commands and aliases, with aliases from
+config/aliases.example.yml.
+"""
+
+import argparse
+import inspect
+import os
+import random
+import time
+from types import SimpleNamespace
+
+from turbo.commands import Commands
+from turbo.exceptions import InvalidUsage
+from turbo.registry import CommandRegistry
+from turbo.utils import Yaml
+
+PREFIX = '~'
+ALIASES = os.path.join(os.path.dirname(__file__), '..', 'config', 'aliases.example.yml')
+
+# Commands sent, roughly as often as they are used
+MIX = [
+    '{prefix}ping',
+    '{prefix}tag hello',
+    '{prefix}t hello',
+    '{prefix}help',
+    '{prefix}help tag',
+    '{prefix}tags',
+    '{prefix}discrim 0001',
+    '{prefix}d',
+    '{prefix}snowflake 123456789012345678',
+    '{prefix}sf',
+    '{prefix}youtube some search terms',
+    '{prefix}yt some search terms',
+    '{prefix}stats',
+    '{prefix}tag',  # missing argument
+]
+
+
+def old_dispatch(commands, aliases, message, prefix):
+    """
+    Returns the handler and keyword arguments for a message like on_message did
+    before the registry, or None
+    """
+    content = message.content.strip()
+    cmd, *args = content.split()
+    cmd = cmd[len(prefix):].lower().strip()
+
+    h = getattr(commands, 'c_%s' % cmd, None)
+
+    if not h:
+        if aliases is not None:
+            for i in aliases:
+                for i2 in aliases[i]:
+                    if cmd == i2:
+                        cmd = i
+                        h = getattr(commands, 'c_%s' % cmd, None)
+                        if not h:
+                            return None
+        else:
+            return None
+    if not h:
+        return None
+
+    s = inspect.signature(h)
+    p = s.parameters.copy()
+    kw = {}
+    if p.pop('message', None):
+        kw['message'] = message
+    if p.pop('channel', None):
+        kw['channel'] = message.channel
+    if p.pop('author', None):
+        kw['author'] = message.author
+    if p.pop('server', None):
+        kw['server'] = message.server
+    if p.pop('args', None):
+        kw['args'] = args
+
+    ae = []
+    for key, param in list(p.items()):
+        doc_key = '[%s=%s]' % (
+            key, param.default) if param.default is not inspect.Parameter.empty else key
+        ae.append(doc_key)
+        if not args and param.default is not inspect.Parameter.empty:
+            p.pop(key)
+            continue
+        if args:
+            v = args.pop(0)
+            kw[key] = v
+            p.pop(key)
+    if p:
+        return h, None
+    return h, kw
+
+
+def new_dispatch(registry, message, prefix):
+    """
+    Returns the handler and keyword arguments for a message like on_message does
+    now, or None
+    """
+    content = message.content.strip()
+    cmd, *args = content.split()
+    command = registry.get(cmd[len(prefix):].lower().strip())
+    if command is None:
+        return None
+    try:
+        return command.handler, command.bind(message, args)
+    except InvalidUsage:
+        return command.handler, None
+
+
+def stream(count, rng):
+    channel = SimpleNamespace(id='2', is_private=False)
+    author = SimpleNamespace(id='3', mention='<@3>')
+    server = SimpleNamespace(id='4')
+    return [SimpleNamespace(content=rng.choice(MIX).format(prefix=PREFIX), channel=channel, author=author,
+                            server=server) for _ in range(count)]
+
+
+def rate(func, messages):
+    start = time.perf_counter()
+    for m in messages:
+        func(m)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks resolving command messages to handlers")
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # Handlers are only looked up, so the commands don't need a bot
+    commands = Commands.__new__(Commands)
+    aliases = Yaml.parse(ALIASES)
+    registry = CommandRegistry(commands, PREFIX)
+    registry.load_aliases(aliases)
+    messages = stream(args.messages, random.Random(args.seed))
+
+    old = lambda m: old_dispatch(commands, aliases, m, PREFIX)
+    new = lambda m: new_dispatch(registry, m, PREFIX)
+    for m in messages[:len(MIX) * 10]:
+        # Both paths must pick the same handler with the same arguments
+        assert old(m) == new(m), m.content
+    old_rate = rate(old, messages)
+    new_rate = rate(new, messages)
+    print("Messages: {}, {} commands, {} aliases".format(len(messages), len(registry), len(registry.aliases)))
+    print("{:<10}{:>16}{:>14}".format('Path', 'Messages/s', 'us/message'))
+    for name, value in (('old', old_rate), ('registry', new_rate)):
+        print("{:<10}{:>16.0f}{:>14.2f}".format(name, value, 10 ** 6 / value))
+    print("Speedup: {:.1f}x".format(new_rate / old_rate))
+
+
+if __name__ == '__main__':
+    main()
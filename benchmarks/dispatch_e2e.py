@@ -0,0 +1,473 @@
+"""
+Benchmarks command dispatch without connecting to Discord
+
+Messages from a synthetic stream (or a recorded one) are fed to Turbo.on_message.
+Discord is replaced by a fake transport, RethinkDB by a connection answering
+queries from in-memory tables and outside HTTP requests are answered by a local
+aiohttp server, so results only depend on the bot's own code and can be
+compared between commits.
+
+    python -m benchmarks.dispatch_e2e [--messages N] [--concurrency N] [--seed N] [--stream FILE] [--alloc]
+
+The bot's log is written to turbo-benchmark.log in the temporary directory.
+
+A recorded stream is a file with one JSON object per line:
+    {"content": "~tag hello", "author": "1", "channel": "2"}
+"""
+
+import argparse
+import asyncio
+import bisect
+import configparser
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.parse
+
+import aiohttp
+from aiohttp import web
+import discord
+from rethinkdb import ast
+
+import turbo
+from turbo import outbound
+from turbo.exceptions import Shutdown
+from turbo.metrics import WebServer
+from turbo.utils import Config
+
+CONFIG = os.path.join(os.path.dirname(__file__), '..', 'config', 'turbo.example.ini')
+LOG = os.path.join(tempfile.gettempdir(), 'turbo-benchmark.log')
+
+TAGS = {'tag{}'.format(i): 'Content of tag number {}'.format(i) * 3 for i in range(200)}
+
+# (weight, content) of synthetic commands, {prefix} and {tag} are filled in
+MIX = [
+    (30, '{prefix}ping'),
+    (25, '{prefix}tag {tag}'),
+    (10, '{prefix}tag missing'),
+    (10, '{prefix}help'),
+    (5, '{prefix}help tag'),
+    (5, '{prefix}tags'),
+    (5, '{prefix}cat'),
+    (5, '{prefix}snowflake'),
+    (5, 'just talking, not a command'),
+]
+
+
+def snowflake(n):
+    """Returns a message ID n milliseconds after a fixed time"""
+    return str((10 ** 11 + n) << 22)
+
+
+class FakeUser:
+
+    def __init__(self, id, name, bot=False):
+        self.id = id
+        self.name = name
+        self.discriminator = '0001'
+        self.bot = bot
+
+    @property
+    def mention(self):
+        return '<@{}>'.format(self.id)
+
+    def __str__(self):
+        return '{}#{}'.format(self.name, self.discriminator)
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeServer:
+
+    def __init__(self, id, me):
+        self.id = id
+        self.name = 'server-{}'.format(id)
+        self.me = me
+
+    def __str__(self):
+        return self.name
+
+
+class FakeChannel:
+
+    def __init__(self, id, server):
+        self.id = id
+        self.name = 'channel-{}'.format(id)
+        self.server = server
+        self.is_private = False
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+
+    def __init__(self, id, content, author, channel):
+        self.id = id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.server = channel.server
+
+
+class FakeHTTP:
+
+    """
+    Stands in for discord.py's HTTP client for the requests made directly
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+
+    async def delete_message(self, channel_id, message_id, guild_id=None):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+    async def delete_messages(self, channel_id, message_ids, guild_id=None):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+    async def close(self):
+        pass
+
+
+class FakeTransport(discord.Client):
+
+    """
+    Answers the Discord requests Turbo makes with local objects
+    Sits between Turbo and discord.Client so Turbo's overrides still run
+    """
+
+    transport_latency = 0.0
+    _ids = itertools.count(10 ** 6)
+
+    async def wait_until_ready(self):
+        pass
+
+    async def _reply(self, channel, content):
+        await asyncio.sleep(self.transport_latency)
+        return FakeMessage(snowflake(next(self._ids)), content, self.user, channel)
+
+    async def send_message(self, destination, content=None, *, tts=False, embed=None):
+        return await self._reply(destination, content)
+
+    async def edit_message(self, message, new_content=None, *, embed=None):
+        message.content = new_content
+        await asyncio.sleep(self.transport_latency)
+        return message
+
+    async def delete_message(self, message):
+        await asyncio.sleep(self.transport_latency)
+
+
+class BenchTurbo(turbo.Turbo, FakeTransport):
+    pass
+
+
+class FakeCursor:
+
+    """
+    Cursor over a list of documents, read like a RethinkDB cursor
+    """
+
+    def __init__(self, docs):
+        self.docs = list(docs)
+
+    async def fetch_next(self):
+        return bool(self.docs)
+
+    async def next(self):
+        return self.docs.pop(0)
+
+
+class FakeConnection:
+
+    """
+    Answers the ReQL queries the database runs from in-memory tables, with
+    latency added to each, so Database itself runs unchanged
+    Only the queries the benchmarked commands make are understood
+    """
+
+    def __init__(self, tables, primary_keys, latency):
+        self.tables = tables  # table name -> {primary key: document}
+        self.primary_keys = primary_keys
+        self.latency = latency
+        self.queries = 0
+
+    def is_open(self):
+        return True
+
+    async def _start(self, term, **options):
+        self.queries += 1
+        await asyncio.sleep(self.latency)
+        if isinstance(term, ast.Table):
+            return FakeCursor(self.evaluate(term).values())
+        result = self.evaluate(term)
+        return FakeCursor(result) if isinstance(result, list) else result
+
+    def evaluate(self, term):
+        if isinstance(term, ast.Datum):
+            return term.data
+        if isinstance(term, ast.MakeObj):
+            return dict((k, self.evaluate(v)) for k, v in term.optargs.items())
+        if isinstance(term, ast.MakeArray):
+            return [self.evaluate(a) for a in term._args]
+        if isinstance(term, ast.Table):
+            return self.tables.setdefault(self.evaluate(term._args[0]), {})
+        if isinstance(term, ast.Get):
+            return self.evaluate(term._args[0]).get(self.evaluate(term._args[1]))
+        if isinstance(term, ast.Pluck):
+            fields = [self.evaluate(a) for a in term._args[1:]]
+            return [dict((f, d[f]) for f in fields if f in d) for d in self.evaluate(term._args[0]).values()]
+        if isinstance(term, ast.Insert):
+            table = self.evaluate(term._args[0]._args[0])
+            doc = self.evaluate(term._args[1])
+            self.evaluate(term._args[0])[doc[self.primary_keys.get(table, 'id')]] = doc
+            return {'inserted': 1}
+        if isinstance(term, ast.Delete):
+            target = term._args[0]
+            if isinstance(target, ast.Get):
+                deleted = int(self.evaluate(target._args[0]).pop(self.evaluate(target._args[1]), None) is not None)
+                return {'deleted': deleted, 'skipped': 1 - deleted}
+            docs = self.evaluate(target)
+            deleted = len(docs)
+            docs.clear()
+            return {'deleted': deleted, 'skipped': 0}
+        raise NotImplementedError("Query not supported by the benchmark: {}".format(term))
+
+
+class LocalSession:
+
+    """
+    Sends every request made through the HTTP client to the local server
+    """
+
+    def __init__(self, base, loop):
+        self.base = base
+        self.session = aiohttp.ClientSession(loop=loop)
+
+    @property
+    def closed(self):
+        return self.session.closed
+
+    def request(self, method, url, **kwargs):
+        parts = urllib.parse.urlsplit(url)
+        return self.session.request(method, self.base + parts.path + ('?' + parts.query if parts.query else ''), **kwargs)
+
+    def close(self):
+        return self.session.close()
+
+
+async def start_server(latency):
+    """
+    Starts a HTTP server on a free local port and returns (server, base URL)
+    """
+    async def meow(request):
+        await asyncio.sleep(latency)
+        return web.json_response({'file': 'http://127.0.0.1/cat.jpg'})
+
+    async def other(request):
+        await asyncio.sleep(latency)
+        return web.Response(text='ok')
+
+    app = web.Application()
+    app.router.add_get('/meow', meow)
+    app.router.add_route('*', '/{tail:.*}', other)
+    server = WebServer(app)
+    port = await server.start('127.0.0.1')
+    return server, 'http://127.0.0.1:{}'.format(port)
+
+
+def synthetic(prefix, count, users, channels, rng):
+    """
+    Yields (content, author, channel) for a random mix of commands
+    """
+    cumulative = list(itertools.accumulate(w for w, _ in MIX))
+    tags = sorted(TAGS)
+    for _ in range(count):
+        template = MIX[bisect.bisect(cumulative, rng.random() * cumulative[-1])][1]
+        content = template.format(prefix=prefix, tag=rng.choice(tags))
+        yield content, rng.choice(users), rng.choice(channels)
+
+
+def recorded(filename, users, channels):
+    """
+    Yields (content, author, channel) from a recorded stream
+    """
+    users = {u.id: u for u in users}
+    channels = {c.id: c for c in channels}
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            author = users.get(str(data.get('author')))
+            if author is None:
+                author = users[str(data.get('author'))] = FakeUser(str(data.get('author')), 'user')
+            channel = channels.get(str(data.get('channel')))
+            if channel is None:
+                channel = next(iter(channels.values()))
+            yield data['content'], author, channel
+
+
+def write_config(filename):
+    """
+    Writes a copy of a config file with a placeholder token, as one is required
+    Console logging is reduced to warnings so printing doesn't dominate the results
+    Returns the path of the copy
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(filename, encoding='utf-8')
+    if not config.get('Auth', 'Token', fallback=None):
+        config.set('Auth', 'Token', 'benchmark')
+    if not config.has_section('Logging'):
+        config.add_section('Logging')
+    config.set('Logging', 'ConsoleLevel', 'WARNING')
+    f = tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False, encoding='utf-8')
+    with f:
+        config.write(f)
+    return f.name
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def run(args):
+    server, base = await start_server(args.http_latency)
+
+    FakeTransport.transport_latency = args.discord_latency
+    config = write_config(args.config)
+    try:
+        # Set up before the bot does, so it doesn't log to the working directory
+        turbo.configure_logging(Config(config), LOG)
+        bot = BenchTurbo(config)
+    finally:
+        os.remove(config)
+    me = FakeUser('1', 'Turbo', bot=True)
+    bot.connection.user = me
+    await bot.http.close()
+    bot.http = FakeHTTP(args.discord_latency)
+    bot.db.db = FakeConnection({bot.db.tags_table: dict(
+        (name, {'name': name, 'content': content}) for name, content in TAGS.items())},
+        {bot.db.tags_table: 'name'}, args.db_latency)
+    bot.db.ready = True
+    bot.dbfailed = False
+    bot.started = time.time()
+    bot.permissions.owner_id = '2'
+    bot.permissions._resolved = time.monotonic()
+    await bot.req.close()
+    bot.req.session = LocalSession(base, bot.loop)
+    if not args.paced:
+        # Local rate limits would make the queues sleep instead of running the bot's code
+        for kind in outbound.LIMITS:
+            outbound.LIMITS[kind] = (10 ** 9, 1.0)
+
+    rng = random.Random(args.seed)
+    users = [FakeUser(str(100 + i), 'user{}'.format(i)) for i in range(args.users)]
+    servers = [FakeServer(str(1000 + i), me) for i in range(max(1, args.channels // 10))]
+    channels = [FakeChannel(str(10000 + i), servers[i % len(servers)]) for i in range(args.channels)]
+    if args.stream:
+        stream = list(recorded(args.stream, users, channels))
+    else:
+        stream = list(synthetic(bot.config.prefix, args.messages, users, channels, rng))
+
+    latencies = {}  # command name -> list of seconds
+    ids = itertools.count()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    def command(content):
+        return content.split()[0][len(bot.config.prefix):] if content.startswith(bot.config.prefix) else '(none)'
+
+    async def dispatch(content, author, channel):
+        message = FakeMessage(snowflake(next(ids)), content, author, channel)
+        async with semaphore:
+            start = time.perf_counter()
+            await bot.on_message(message)
+            latencies.setdefault(command(content), []).append(time.perf_counter() - start)
+
+    # Warm up caches and lazily built state before measuring
+    await asyncio.gather(*[dispatch(*m) for m in stream[:min(len(stream), 100)]])
+    latencies.clear()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[dispatch(*m) for m in stream])
+    elapsed = time.perf_counter() - start
+
+    print("Messages: {} in {:.3f}s ({:.0f}/s, concurrency {}, seed {})".format(
+        len(stream), elapsed, len(stream) / elapsed if elapsed else 0, args.concurrency, args.seed))
+    print()
+    print("{:<14}{:>8}{:>12}{:>12}{:>12}".format('Command', 'Count', 'p50 (ms)', 'p99 (ms)', 'Max (ms)'))
+    for name, values in sorted(latencies.items(), key=lambda i: -len(i[1])):
+        print("{:<14}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}".format(
+            name, len(values), percentile(values, 50) * 1000, percentile(values, 99) * 1000, max(values) * 1000))
+    print()
+
+    if args.alloc:
+        # Traced in a separate pass, one command at a time, as tracing slows
+        # everything down and concurrent commands would share their allocations
+        groups = {}
+        for m in stream:
+            groups.setdefault(command(m[0]), []).append(m)
+        print("{:<14}{:>8}{:>16}{:>16}{:>12}".format(
+            'Command', 'Count', 'Bytes/message', 'Blocks/message', 'Peak (KiB)'))
+        for name, messages in sorted(groups.items(), key=lambda i: -len(i[1])):
+            tracemalloc.start()
+            for m in messages:
+                await dispatch(*m)
+            retained, peak = tracemalloc.get_traced_memory()
+            blocks = sum(s.count for s in tracemalloc.take_snapshot().statistics('filename'))
+            tracemalloc.stop()
+            print("{:<14}{:>8}{:>16.0f}{:>16.1f}{:>12.1f}".format(
+                name, len(messages), retained / len(messages), blocks / len(messages), peak / 1024))
+        print()
+
+    print("Outbound: {requests} requests, {merged} merged, {paced} paced".format(**bot.outbound.stats()))
+    print("Database: {} queries, tag cache {}".format(bot.db.db.queries, bot.db.tag_cache.stats()))
+    print("HTTP: {requests} requests, {coalesced} shared".format(**bot.req.stats()))
+
+    if bot.deletions._timer is not None:
+        bot.deletions._timer.cancel()
+    await bot.close()
+    await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks Turbo's command dispatch offline")
+    parser.add_argument('--config', default=CONFIG, help="config file to use")
+    parser.add_argument('--messages', type=int, default=10000, help="synthetic messages to send")
+    parser.add_argument('--stream', help="recorded stream of messages to send instead")
+    parser.add_argument('--concurrency', type=int, default=50, help="messages dispatched at once")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--discord-latency', type=float, default=0.0, help="seconds added to Discord requests")
+    parser.add_argument('--db-latency', type=float, default=0.0, help="seconds added to database queries")
+    parser.add_argument('--http-latency', type=float, default=0.0, help="seconds added to HTTP responses")
+    parser.add_argument('--paced', action='store_true', help="keep the outbound rate limits")
+    parser.add_argument('--alloc', action='store_true', help="also trace memory allocations of each command")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(run(args))
+    except Shutdown:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
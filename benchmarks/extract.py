@@ -0,0 +1,97 @@
+"""
+Benchmarks ClassExtractor against BeautifulSoup, which the youtube command used
+before, on saved result pages
+
+    python -m benchmarks.extract [--runs N] [--chunk-size N] [pages...]
+
+Pages are the gzipped HTML files in benchmarks/fixtures unless others are given.
+ClassExtractor is fed the page in chunks as they would arrive from the network,
+BeautifulSoup gets the whole page at once like the old command did. Latency is
+the average over the runs and peak memory is traced on a separate run.
+BeautifulSoup is optional, install beautifulsoup4 to compare against it.
+"""
+
+import argparse
+import glob
+import gzip
+import os
+import time
+import tracemalloc
+
+from turbo.extract import ClassExtractor
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+CLASS = 'yt-uix-tile-link'
+LIMIT = 5
+
+
+def load(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return f.read()
+
+
+def extractor(page, chunk_size):
+    parser = ClassExtractor(CLASS, LIMIT, required=('href', 'title'))
+    for i in range(0, len(page), chunk_size):
+        if parser.feed_bytes(page[i:i + chunk_size]):
+            break
+    return [(r['href'], r['title']) for r in parser.results]
+
+
+def soup(page, chunk_size):
+    html = page.decode('utf-8', errors='replace')
+    tags = BeautifulSoup(html, 'html.parser').find_all(attrs={'class': CLASS})
+    return [(t['href'], t['title']) for t in tags if t.get('href') and t.get('title')][:LIMIT]
+
+
+def measure(func, page, chunk_size, runs):
+    """
+    Returns (result, average seconds, peak bytes) of a parser on a page
+    """
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = func(page, chunk_size)
+    elapsed = (time.perf_counter() - start) / runs
+
+    tracemalloc.start()
+    func(page, chunk_size)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the HTML extraction used by the youtube command")
+    parser.add_argument('pages', nargs='*', help="HTML files to parse (gzipped if ending in .gz)")
+    parser.add_argument('--runs', type=int, default=20, help="times each page is parsed")
+    parser.add_argument('--chunk-size', type=int, default=65536, help="bytes fed to ClassExtractor at a time")
+    args = parser.parse_args()
+
+    parsers = [('ClassExtractor', extractor)]
+    if BeautifulSoup is None:
+        print("beautifulsoup4 is not installed, only ClassExtractor is measured")
+    else:
+        parsers.append(('BeautifulSoup', soup))
+
+    print("{:<28}{:>10}  {:<14}{:>10}{:>14}{:>16}".format(
+        'Page', 'Size (KiB)', 'Parser', 'Results', 'Latency (ms)', 'Peak mem (KiB)'))
+    for path in args.pages or sorted(glob.glob(os.path.join(FIXTURES, '*.html*'))):
+        page = load(path)
+        results = []
+        for name, func in parsers:
+            result, elapsed, peak = measure(func, page, args.chunk_size, args.runs)
+            results.append(result)
+            print("{:<28}{:>10.1f}  {:<14}{:>10}{:>14.2f}{:>16.1f}".format(
+                os.path.basename(path), len(page) / 1024, name, len(result), elapsed * 1000, peak / 1024))
+        if any(r != results[0] for r in results):
+            print("WARNING: the parsers found different results for {}".format(path))
+
+
+if __name__ == '__main__':
+    main()
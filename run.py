@@ -3,7 +3,15 @@ from __future__ import print_function
 import sys
 import os
 import gc
+import time
+import argparse
 import traceback
+import multiprocessing
+
+SHARD_START_DELAY = 5  # seconds between starting shards, Discord limits how fast they can connect
+SHARD_STABLE = 300  # seconds a shard must run for before its restart backoff is reset
+SHARD_MAX_BACKOFF = 300
+SHARD_FATAL = 2  # exit code of a shard that cannot start, so it is not restarted
 
 
 def checks():
@@ -35,9 +43,103 @@ def stop_script():
     sys.exit(1)
 
 
+def run_shard(shard_id, shard_count, config_file='config/turbo.ini'):
+    """
+    Runs one shard of the bot in a worker process
+    Exits with 0 if it was shut down on purpose, SHARD_FATAL if it cannot start,
+    otherwise 1 so it is restarted
+    """
+    try:
+        import turbo
+    except ImportError as e:
+        print("ERROR: {}".format(e))
+        print("Try running: 'python -m pip install -U -r requirements.txt'")
+        sys.exit(SHARD_FATAL)
+    try:
+        bot = turbo.Turbo(config_file, shard_id=shard_id, shard_count=shard_count)
+    except Exception as e:
+        if e.__class__.__name__ != "Shutdown":
+            traceback.print_exc()
+        # The config is shared, so every shard would fail the same way
+        sys.exit(SHARD_FATAL)
+    try:
+        bot.run(bot.config.token)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+    if bot.shutting_down:
+        sys.exit(0)
+    if bot.login_failed:
+        sys.exit(SHARD_FATAL)
+    # Disconnected or stopped by an error from Discord, so it is restarted
+    sys.exit(1)
+
+
+def supervise(shard_count):
+    """
+    Runs each shard in its own process, restarting shards that crash with backoff
+    Every shard is stopped once one of them is shut down
+    """
+    processes = {}  # shard id -> process
+    started = {}  # shard id -> time it was started
+    backoff = dict.fromkeys(range(shard_count), 1)
+    restarts = {}  # shard id -> time to restart it at
+
+    def start(shard_id):
+        p = multiprocessing.Process(target=run_shard, args=(shard_id, shard_count), name='shard-{}'.format(shard_id))
+        p.start()
+        processes[shard_id] = p
+        started[shard_id] = time.monotonic()
+        print('Started shard {} of {} (PID {})'.format(shard_id + 1, shard_count, p.pid))
+
+    try:
+        for i in range(shard_count):
+            if i:
+                time.sleep(SHARD_START_DELAY)
+            start(i)
+        while processes or restarts:
+            time.sleep(1)
+            now = time.monotonic()
+            for i, p in list(processes.items()):
+                if p.is_alive():
+                    continue
+                del processes[i]
+                if p.exitcode == 0:
+                    print('Shard {} was shut down, stopping every shard'.format(i + 1))
+                    return
+                if p.exitcode == SHARD_FATAL:
+                    print('ERROR: Shard {} could not start, stopping every shard'.format(i + 1))
+                    return
+                if now - started[i] > SHARD_STABLE:
+                    backoff[i] = 1
+                print('ERROR: Shard {} exited with code {}, restarting in {}s'.format(i + 1, p.exitcode, backoff[i]))
+                restarts[i] = now + backoff[i]
+                backoff[i] = min(backoff[i] * 2, SHARD_MAX_BACKOFF)
+            for i, at in list(restarts.items()):
+                if now >= at:
+                    del restarts[i]
+                    start(i)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in processes.values():
+            p.terminate()
+        for p in processes.values():
+            p.join()
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Runs Turbo')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='split the bot into this many shards, each run in its own process')
+    args = parser.parse_args()
+
     checks()
 
+    if args.shards > 0:
+        supervise(args.shards)
+        stop_script()
+
     try:
         import turbo
         bot = turbo.Turbo()
@@ -51,11 +153,6 @@ def main():
                 pass
         else:
             traceback.print_exc()
-    finally:
-        try:
-            bot.session.close()  # Close aiohttp session if it is running
-        except Exception:
-            pass
 
     gc.collect()  # Garbage collect
     stop_script()
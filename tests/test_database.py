@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+
+from turbo import database
+from turbo.database import Database
+
+
+class FakeCursor:
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+
+    async def fetch_next(self):
+        if not self.changes:
+            # A changefeed waits for the next change
+            await asyncio.sleep(3600)
+        if isinstance(self.changes[0], Exception):
+            raise self.changes.pop(0)
+        return True
+
+    async def next(self):
+        return self.changes.pop(0)
+
+
+class FakeFeed:
+
+    """
+    Stands in for r.table(...).changes(...), giving out one cursor per run
+    """
+
+    def __init__(self, *cursors):
+        self.cursors = list(cursors)
+        self.runs = 0
+
+    def table(self, name):
+        return self
+
+    def changes(self, **kwargs):
+        return self
+
+    async def run(self, conn):
+        self.runs += 1
+        return self.cursors.pop(0)
+
+
+def tag(name, content):
+    return {'old_val': None, 'new_val': {'name': name, 'content': content}}
+
+
+def test_changefeed_recovers_from_unexpected_errors(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    feed = FakeFeed(FakeCursor([tag('a', '1'), {'state': 'ready'}, KeyError('name')]),
+                    FakeCursor([tag('b', '2'), {'state': 'ready'}]))
+    monkeypatch.setattr(database.r, 'table', feed.table)
+    config = SimpleNamespace(rname='turbo', dbtable_tags='tags', dbtable_shards='shards',
+                             tagcachesize=10, tagcachebytes=1024, tagcachettl=60)
+    db = Database(SimpleNamespace(config=config))
+    db.db = SimpleNamespace(is_open=lambda: True)
+
+    async def check():
+        db.watch_tags()
+        while feed.runs < 2 or db.live_tags is None:
+            await asyncio.sleep(0.05)
+        assert db.live_tags == {'b': '2'}
+        assert not db._feed.done()
+        db.stop_watching_tags()
+
+    try:
+        loop.run_until_complete(asyncio.wait_for(check(), 10))
+    finally:
+        loop.close()
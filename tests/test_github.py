@@ -0,0 +1,135 @@
+import asyncio
+import urllib.parse
+
+from aiohttp import web
+
+from turbo import github
+from turbo.executor import EXECUTOR
+from turbo.github import IssueIndex
+from turbo.metrics import WebServer
+from turbo.req import HTTPClient
+
+
+class FakeGitHub:
+
+    """
+    Serves the issues endpoint of a repository from a list of issues
+    """
+
+    def __init__(self, issues):
+        self.issues = issues
+        self.requests = []  # query of each request
+
+    async def handle(self, request):
+        query = dict(urllib.parse.parse_qsl(request.query_string))
+        self.requests.append(query)
+        if request.match_info['repo'] != 'owner/repo':
+            return web.json_response({'message': 'Not Found'}, status=404)
+        issues = [i for i in self.issues if query['state'] == 'all' or i['state'] == query['state']]
+        if 'since' in query:
+            issues = [i for i in issues if i['updated_at'] >= query['since']]
+        per_page, page = int(query['per_page']), int(query['page'])
+        await asyncio.sleep(0.01)
+        return web.json_response(issues[(page - 1) * per_page:page * per_page])
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('GET', '/repos/{repo:.+}/issues', self.handle)
+        self.server = WebServer(app)
+        return 'http://127.0.0.1:{}'.format(await self.server.start('127.0.0.1'))
+
+
+def issue(number, title, state='open', updated='2017-01-01T00:00:00Z'):
+    return {'number': number, 'title': title, 'body': '', 'state': state,
+            'updated_at': updated, 'html_url': 'https://github.com/owner/repo/issues/{}'.format(number)}
+
+
+def run(issues, test, monkeypatch, **options):
+    """
+    Runs test(index, server) against a fake GitHub serving issues
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = FakeGitHub(issues)
+    EXECUTOR.configure('inline')
+
+    async def main():
+        base = await server.start()
+        monkeypatch.setattr(github, 'API', base + '/repos/{0}/issues')
+        req = HTTPClient(loop=loop)
+        try:
+            await test(IssueIndex(req, **options), server)
+        finally:
+            await req.close()
+            await server.server.stop()
+
+    try:
+        loop.run_until_complete(main())
+    finally:
+        EXECUTOR.configure()
+        loop.close()
+
+
+def test_fetches_every_page_and_refreshes(monkeypatch):
+    issues = [issue(n, 'crash number {}'.format(n)) for n in range(1, 26)]
+    issues.append(issue(26, 'memory leak in the cache'))
+
+    async def test(index, server):
+        repo = await index.get('Owner/Repo')
+        assert len(repo.issues) == 26
+        assert [i['number'] for i in await index.search('owner/repo', 'memory leak')][:1] == [26]
+        assert [i['number'] for i in await repo.search('memroy')] == [26]
+        # 3 pages of 10 are needed, fetched 2 at a time
+        assert sorted(int(r['page']) for r in server.requests) == [1, 2, 3, 4]
+
+        server.issues[25] = issue(26, 'memory leak in the cache', 'closed', '2017-02-01T00:00:00Z')
+        index.refresh = 0
+        repo = await index.get('owner/repo')
+        assert 26 not in repo.issues
+        assert server.requests[-1]['since'] == '2017-01-01T00:00:00Z'
+        assert index._locks == {}
+    run(issues, test, monkeypatch, fanout=2, per_page=10)
+
+
+def test_stops_after_max_pages(monkeypatch):
+    issues = [issue(n, 'issue {}'.format(n)) for n in range(1, 1001)]
+
+    async def test(index, server):
+        repo = await index.get('owner/repo')
+        assert len(server.requests) == 5
+        assert len(repo.issues) == 50
+    run(issues, test, monkeypatch, fanout=4, per_page=10, max_pages=5)
+
+
+def test_concurrent_gets_fetch_once(monkeypatch):
+    issues = [issue(n, 'issue {}'.format(n)) for n in range(1, 6)]
+
+    async def test(index, server):
+        repos = await asyncio.gather(*[index.get('owner/repo') for _ in range(10)])
+        assert all(r is repos[0] for r in repos)
+        assert len(server.requests) == 1
+        assert index._locks == {}
+
+        # Failed lookups don't leave their lock behind either
+        for i in range(10):
+            try:
+                await index.get('missing/repo{}'.format(i))
+            except LookupError:
+                pass
+            else:
+                raise AssertionError("missing repo was found")
+        assert index._locks == {}
+    run(issues, test, monkeypatch, fanout=1, per_page=10)
+
+
+def test_refresh_without_issues_only_fetches_open_ones(monkeypatch):
+    async def test(index, server):
+        repo = await index.get('owner/repo')
+        assert repo.since is None
+        server.issues.append(issue(1, 'first issue'))
+        index.refresh = 0
+        repo = await index.get('owner/repo')
+        assert [r['state'] for r in server.requests] == ['open', 'open']
+        assert 'since' not in server.requests[-1]
+        assert list(repo.issues) == [1]
+    run([], test, monkeypatch, fanout=1, per_page=10)
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+from turbo.limits import limit
+
+
+def message(user, server='1'):
+    return SimpleNamespace(author=SimpleNamespace(id=user), server=SimpleNamespace(id=server),
+                           channel=SimpleNamespace(id='2'))
+
+
+def command():
+    pass
+
+
+def test_rejected_use_does_not_spend_other_buckets():
+    # Applied bottom-up like stacked decorators, so the server bucket is checked first
+    limit(3, 30, 'user')(limit(10, 30, 'server')(command))
+    lim = command.__limit__
+
+    spammer = message('a')
+    allowed = 0
+    for _ in range(12):
+        if lim.acquire(spammer) is None:
+            allowed += 1
+            lim.release()
+    assert allowed == 3
+
+    assert lim.acquire(message('b')) is None
+    lim.release()
+
+
+def test_concurrency_cap():
+    def handler():
+        pass
+    lim = limit(concurrency=1)(handler).__limit__
+    assert lim.acquire(message('a')) is None
+    assert lim.acquire(message('b')) == "is busy, try again shortly"
+    lim.release()
+    assert lim.acquire(message('b')) is None
@@ -0,0 +1,36 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from turbo.main import Turbo
+from turbo.outbound import Outbound
+
+
+def test_unmerged_messages_are_sent_alone(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sent = []
+
+    async def send_message(self, destination, content=None, *, tts=False, embed=None):
+        sent.append(content)
+        return SimpleNamespace(id=str(len(sent)), content=content)
+    monkeypatch.setattr(discord.Client, 'send_message', send_message)
+
+    # Only what send_message uses, without logging in
+    bot = Turbo.__new__(Turbo)
+    bot.outbound = Outbound(loop=loop)
+    bot.config = SimpleNamespace(delete=False)
+    channel = SimpleNamespace(id='1', name='general')
+    try:
+        # Tasks start in the order they are made, so the messages are queued in order
+        messages = loop.run_until_complete(asyncio.gather(*[asyncio.ensure_future(c) for c in (
+            bot.send_message(channel, 'a'),
+            bot.send_message(channel, 'status', merge=False),
+            bot.send_message(channel, 'b'),
+            bot.send_message(channel, 'c'))]))
+        assert sent == ['a', 'status', 'b\nc']
+        assert messages[1].content == 'status'
+        assert bot.outbound.merged == 1
+    finally:
+        loop.close()
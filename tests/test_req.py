@@ -0,0 +1,94 @@
+import asyncio
+
+from aiohttp import web
+
+from turbo.metrics import WebServer
+from turbo.req import HTTPClient
+
+
+class StubServer:
+
+    """
+    Local HTTP server that counts the requests it gets for each path
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.hits = []  # (path, query string, authorization header)
+
+    async def handle(self, request):
+        self.hits.append((request.path, request.query_string, request.headers.get('Authorization')))
+        await asyncio.sleep(self.delay)
+        return web.json_response({'path': request.path, 'query': request.query_string,
+                                  'authorization': request.headers.get('Authorization')},
+                                 headers={'Cache-Control': 'max-age=60'})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('GET', '/{tail:.*}', self.handle)
+        self.server = WebServer(app)
+        return 'http://127.0.0.1:{}'.format(await self.server.start('127.0.0.1'))
+
+    async def stop(self):
+        await self.server.stop()
+
+
+def run(test, **client_options):
+    """
+    Runs test(client, server, base URL) against a fresh stub server
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = StubServer()
+
+    async def main():
+        base = await server.start()
+        client = HTTPClient(loop=loop, **client_options)
+        try:
+            await test(client, server, base)
+        finally:
+            await client.close()
+            await server.stop()
+
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def test_cache_keeps_responses_for_different_headers_apart():
+    async def test(client, server, base):
+        alice = await client.get(base + '/me', headers={'Authorization': 'alice'})
+        bob = await client.get(base + '/me', headers={'Authorization': 'bob'})
+        assert (alice['authorization'], bob['authorization']) == ('alice', 'bob')
+        assert len(server.hits) == 2
+
+        # Cached per header, and headers that do not vary the response share it
+        again = await client.get(base + '/me', headers={'Authorization': 'alice', 'X-Trace': '1'})
+        assert again['authorization'] == 'alice'
+        assert len(server.hits) == 2
+    run(test, cache_bytes=1 << 20)
+
+
+def test_cache_is_skipped_for_request_options():
+    async def test(client, server, base):
+        first = await client.get(base + '/search', params={'q': 'a'})
+        second = await client.get(base + '/search', params={'q': 'b'})
+        assert (first['query'], second['query']) == ('q=a', 'q=b')
+        assert len(server.hits) == 2
+        assert client.cache.stats()['entries'] == 0
+    run(test, cache_bytes=1 << 20)
+
+
+def test_concurrent_identical_gets_share_one_request():
+    async def test(client, server, base):
+        server.delay = 0.2
+        results = await asyncio.gather(*[client.get(base + '/meow') for _ in range(100)])
+        assert len(server.hits) == 1
+        assert all(r == results[0] for r in results)
+        assert client.stats()['coalesced'] == 99
+
+        # Once it has finished, the next call makes a new request
+        await client.get(base + '/meow')
+        assert len(server.hits) == 2
+    run(test)
@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from turbo.metrics import OUTBOUND
+from turbo.outbound import Outbound
+from turbo.scheduler import DeletionScheduler
+
+
+class FakeHTTP:
+
+    def __init__(self):
+        self.deleted = []
+
+    async def delete_message(self, channel_id, message_id, guild_id=None):
+        self.deleted.append(message_id)
+
+    async def delete_messages(self, channel_id, message_ids, guild_id=None):
+        self.deleted.append(list(message_ids))
+
+
+def bot(loop, manage_messages):
+    channel = SimpleNamespace(server=SimpleNamespace(me=None),
+                              permissions_for=lambda member: SimpleNamespace(manage_messages=manage_messages))
+    return SimpleNamespace(loop=loop, http=FakeHTTP(), outbound=Outbound(loop=loop),
+                           user=SimpleNamespace(bot=True), get_channel=lambda id: channel)
+
+
+def test_deletes_go_through_outbound():
+    loop = asyncio.new_event_loop()
+    try:
+        for manage_messages, kind, deleted in ((True, 'bulk_delete', [['1', '2', '3']]),
+                                               (False, 'delete', ['1', '2', '3'])):
+            b = bot(loop, manage_messages)
+            before = OUTBOUND.labels(kind, 'ok').count
+            loop.run_until_complete(DeletionScheduler(b)._delete('10', '20', ['1', '2', '3']))
+            assert b.http.deleted == deleted
+            assert b.outbound.requests == len(deleted)
+            assert OUTBOUND.labels(kind, 'ok').count - before == len(deleted)
+    finally:
+        loop.close()
+
+
+def error(cls, status):
+    return cls(SimpleNamespace(status=status, reason='Error', headers={}), 'error')
+
+
+class RejectingHTTP(FakeHTTP):
+
+    """
+    Rejects bulk deletes like Discord does with a message older than 14 days
+    """
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors  # message id -> exception deleting it raises
+
+    async def delete_message(self, channel_id, message_id, guild_id=None):
+        if message_id in self.errors:
+            raise self.errors[message_id]
+        await super().delete_message(channel_id, message_id, guild_id)
+
+    async def delete_messages(self, channel_id, message_ids, guild_id=None):
+        raise error(discord.HTTPException, 400)
+
+
+def test_failed_bulk_delete_retries_each_message(tmpdir):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        b = bot(loop, True)
+        b.http = RejectingHTTP({'2': error(discord.NotFound, 404), '3': error(discord.HTTPException, 500)})
+        scheduler = DeletionScheduler(b, persist=str(tmpdir.join('deletions.json')))
+        for m in ('1', '2', '3', '4'):
+            scheduler.store.set(m, ['10', '20', 0])
+        loop.run_until_complete(scheduler._delete('10', '20', ['1', '2', '3', '4']))
+        assert b.http.deleted == ['1', '4']
+        # Only the message that could not be deleted is kept for next time
+        assert scheduler.store.data == {'3': ['10', '20', 0]}
+    finally:
+        loop.close()
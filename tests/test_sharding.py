@@ -0,0 +1,155 @@
+"""
+Runs shards against a fake Discord, serving the REST API and the gateway locally
+"""
+import asyncio
+import configparser
+import inspect
+import json
+import os
+import threading
+
+import discord
+import pytest
+from aiohttp import web
+
+import run
+from turbo.metrics import WebServer
+
+OWNER = {'id': '42', 'username': 'owner', 'discriminator': '0001', 'avatar': None, 'bot': False}
+BOT = {'id': '1', 'username': 'turbo', 'discriminator': '0002', 'avatar': None, 'bot': True}
+CHANNEL = '10'
+
+
+def as_json(data, status=200):
+    return web.Response(body=json.dumps(data).encode(), status=status, content_type='application/json')
+
+
+async def send_json(ws, data):
+    # send_str is only a coroutine from aiohttp 2.0
+    result = ws.send_str(json.dumps(data))
+    if inspect.isawaitable(result):
+        await result
+
+
+class FakeDiscord:
+
+    """
+    Answers the requests a shard makes to log in, and sends it a shutdown command
+    once it has identified
+    """
+
+    def __init__(self, *, login_status=200):
+        self.login_status = login_status
+        self.identified = []  # shard given in each identify payload
+        self.sent = []  # content of messages the bot sent
+        self.ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.port = asyncio.run_coroutine_threadsafe(self._serve(), self.loop).result(10)
+
+    async def _serve(self):
+        # Made on the server's loop, older aiohttp versions bind the application to it
+        app = web.Application()
+        app.router.add_get('/api/v6/users/@me', self.me)
+        app.router.add_get('/api/v6/gateway', self.gateway)
+        app.router.add_get('/api/v6/oauth2/applications/@me', self.application)
+        app.router.add_post('/api/v6/channels/{channel}/messages', self.send)
+        app.router.add_get('/ws', self.websocket)
+        self.server = WebServer(app, loop=self.loop)
+        return await self.server.start('127.0.0.1')
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(10)
+
+    async def me(self, request):
+        if self.login_status != 200:
+            return as_json({'message': 'Forbidden', 'code': 0}, status=self.login_status)
+        return as_json(BOT)
+
+    async def gateway(self, request):
+        return as_json({'url': 'ws://127.0.0.1:{}/ws'.format(self.port)})
+
+    async def application(self, request):
+        return as_json({'id': BOT['id'], 'name': 'turbo', 'description': '', 'icon': None, 'owner': OWNER})
+
+    async def send(self, request):
+        data = await request.json()
+        self.sent.append(data.get('content'))
+        return as_json(dict(self.message(data.get('content')), author=BOT))
+
+    def message(self, content):
+        return {'id': str(100 + len(self.sent)), 'channel_id': CHANNEL, 'author': OWNER, 'content': content,
+                'timestamp': '2017-01-01T00:00:00+00:00', 'embeds': [], 'attachments': [],
+                'mentions': [], 'mention_roles': [], 'reactions': [], 'type': 0}
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await send_json(ws, {'op': 10, 'd': {'heartbeat_interval': 500}})
+        async for msg in ws:
+            payload = json.loads(msg.data)
+            if payload['op'] == 2:
+                self.identified.append(payload['d'].get('shard'))
+                await send_json(ws, {'op': 0, 's': 1, 't': 'READY', 'd': {
+                    'v': 6, 'user': BOT, 'guilds': [], 'session_id': 'session',
+                    'private_channels': [{'id': CHANNEL, 'type': 1, 'recipients': [OWNER]}]}})
+                self.ready.set()
+            elif payload['op'] == 1:
+                await send_json(ws, {'op': 11})
+                # Commands are ignored until the bot has finished getting ready,
+                # so the command is repeated until it is answered
+                if not self.sent:
+                    await send_json(ws, {'op': 0, 's': 2, 't': 'MESSAGE_CREATE', 'd': self.message('!shutdown')})
+        return ws
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    server = FakeDiscord()
+    server.start()
+    monkeypatch.setattr(discord.http.Route, 'BASE', 'http://127.0.0.1:{}/api/v6'.format(server.port))
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def config_file(tmpdir, monkeypatch):
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(os.path.join(os.path.dirname(run.__file__), 'config', 'turbo.example.ini'), encoding='utf-8')
+    config.set('Auth', 'Token', 'token')
+    config.set('General', 'Prefix', '!')
+    config.set('General', 'Delete', 'False')
+    config.set('Advanced', 'NoDatabase', 'True')
+    config.set('Advanced', 'ReadAliases', 'False')
+    path = str(tmpdir.join('turbo.ini'))
+    with open(path, 'w', encoding='utf-8') as f:
+        config.write(f)
+    # Shards write their logs and pending deletions to the working directory
+    monkeypatch.chdir(str(tmpdir))
+    return path
+
+
+def run_shard(shard_id, shard_count, config_file):
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    with pytest.raises(SystemExit) as exit:
+        run.run_shard(shard_id, shard_count, config_file)
+    return exit.value.code
+
+
+def test_shutdown_stops_every_shard(fake, config_file):
+    assert run_shard(1, 2, config_file) == 0
+    assert fake.identified == [[1, 2]]
+    assert fake.sent == [':wave:']
+
+
+def test_http_error_restarts_shard(fake, config_file):
+    # discord.py retries server errors for a while, a 403 is raised straight away
+    fake.login_status = 403
+    assert run_shard(0, 2, config_file) == 1
+    assert not fake.ready.is_set()
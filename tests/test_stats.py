@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from turbo import tasks
+from turbo.executor import EXECUTOR, SPAWN
+from turbo.stats import Stats
+
+
+def member(id, avatar=None, bot=False):
+    return SimpleNamespace(id=id, avatar=avatar, bot=bot)
+
+
+def server(id, members, mfa_level=0, emojis=()):
+    return SimpleNamespace(id=id, members=members, mfa_level=mfa_level, emojis=list(emojis))
+
+
+def servers():
+    return [server('1', [member('a', 'x'), member('b', bot=True)], mfa_level=1),
+            server('2', [member('a', 'x'), member('c')], emojis=['e'])]
+
+
+def test_verify_loads_recount():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    EXECUTOR.configure('inline')
+    try:
+        stats = Stats()
+        stats.build(servers())
+        expected = stats.snapshot()
+        stats.members += 5
+        stats.users -= 1
+
+        drift = loop.run_until_complete(stats.verify(servers()))
+        assert drift == {'members': (9, 4), 'users': (2, 3)}
+        assert stats.snapshot() == expected
+
+        # The loaded state keeps following events
+        stats.remove_member(member('a', 'x'))
+        assert (stats.members, stats.users, stats.avatar_members) == (3, 3, 1)
+        assert loop.run_until_complete(stats.verify([])) != {}
+    finally:
+        EXECUTOR.configure()
+        loop.close()
+
+
+def run_in_process_pool(func, args):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    EXECUTOR.configure('process', 1)
+    try:
+        return loop.run_until_complete(EXECUTOR.submit(func, args))
+    finally:
+        EXECUTOR.configure()
+        loop.close()
+
+
+def test_process_pool_counts_members():
+    totals, users, flags = run_in_process_pool(tasks.count_members, ([('1', True, False, [('a', True, False)])],))
+    assert totals['members'] == 1
+    assert users == {'a': [1, True, False]}
+
+
+@pytest.mark.skipif(not SPAWN, reason="forked workers have everything the parent imported")
+def test_process_workers_do_not_import_turbo():
+    # Functions are sent by name, a builtin keeps the test module out of the worker
+    imported = run_in_process_pool(eval, (
+        "__import__('turbo.tasks') and [m for m in ('turbo.main', 'discord') if m in __import__('sys').modules]",))
+    assert imported == []
@@ -0,0 +1,55 @@
+import asyncio
+import json
+import os
+import stat
+
+from turbo.utils import JsonStore, dump_json_atomic
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_changes_before_loading_keep_the_file(tmpdir):
+    path = str(tmpdir.join('tags.json'))
+    with open(path, 'w') as f:
+        json.dump({'a': '1', 'b': '2'}, f)
+
+    async def test():
+        store = JsonStore(path, save_delay=0)
+        store.set('c', '3')
+        store.remove('a')
+        await store.save()
+        assert store.loaded
+        with open(path) as f:
+            assert json.load(f) == {'b': '2', 'c': '3'}
+    run(test())
+
+
+def test_file_that_fails_to_load_is_not_saved(tmpdir):
+    path = str(tmpdir.join('tags.json'))
+    with open(path, 'w') as f:
+        f.write('{"a": ')
+
+    async def test():
+        store = JsonStore(path, save_delay=0)
+        store.set('c', '3')
+        await store.save()
+        assert not store.loaded
+        with open(path) as f:
+            assert f.read() == '{"a": '
+    run(test())
+
+
+def test_atomic_dump_keeps_the_file_mode(tmpdir):
+    path = str(tmpdir.join('tags.json'))
+    dump_json_atomic(path, {})
+    os.chmod(path, 0o640)
+    dump_json_atomic(path, {'a': '1'})
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert [f for f in os.listdir(str(tmpdir))] == ['tags.json']
@@ -1,37 +1,25 @@
+import importlib
 import sys
-import logging
-import colorlog
-
-from .main import Turbo
-
-__all__ = ['Turbo']
-
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-fh = logging.FileHandler(
-    filename='turbo.log', encoding='utf-8', mode='w')
-fh.setFormatter(logging.Formatter(
-    "[{asctime}] {levelname} ({filename} L{lineno}, {funcName}): {message}", style='{'
-))
-sh = logging.StreamHandler(stream=sys.stdout)
-sh.setFormatter(colorlog.LevelFormatter(
-    fmt={
-        "DEBUG": "{log_color}{levelname} ({module} L{lineno}, {funcName}): {message}",
-        "INFO": "{log_color}{message}",
-        "WARNING": "{log_color}{levelname}: {message}",
-        "ERROR": "{log_color}{levelname} ({module} L{lineno}, {funcName}): {message}",
-        "CRITICAL": "{log_color}{levelname} ({module} L{lineno}, {funcName}): {message}"
-    },
-    log_colors={
-        "DEBUG": "purple",
-        "INFO": "white",
-        "WARNING": "yellow",
-        "ERROR": "red",
-        "CRITICAL": "bold_red"
-    },
-    style='{'
-))
-sh.setLevel(logging.DEBUG)
-
-logger.addHandler(fh)
-logger.addHandler(sh)
+import types
+
+__all__ = ['Turbo', 'configure_logging']
+
+# Where each name is imported from. The bot is only imported once it is used,
+# so process pool workers can import turbo.tasks without importing discord
+_EXPORTS = {'Turbo': '.main', 'configure_logging': '.logs'}
+
+
+class _Package(types.ModuleType):
+
+    def __getattr__(self, name):
+        if name not in _EXPORTS:
+            raise AttributeError("module {!r} has no attribute {!r}".format(self.__name__, name))
+        value = getattr(importlib.import_module(_EXPORTS[name], self.__name__), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(_EXPORTS))
+
+
+sys.modules[__name__].__class__ = _Package
@@ -0,0 +1,111 @@
+import time
+import logging
+
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+def default_sizeof(key, value):
+    """Approximates the memory used by an entry in bytes"""
+    return len(str(key).encode()) + len(str(value).encode())
+
+
+class LRUCache:
+
+    """
+    Least recently used cache bounded by entry count and size in bytes
+    Entries can optionally expire after a time to live (in seconds)
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=0, ttl=0, sizeof=default_sizeof, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+
+        self._data = OrderedDict()  # key -> (value, size, expires)
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, *, count=True):
+        """
+        Returns the value for a key, or default if missing or expired
+        """
+        entry = self._data.get(key)
+        if entry is not None and entry[2] and entry[2] < time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            if count:
+                self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        if count:
+            self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entries if needed
+        """
+        size = self.sizeof(key, value)
+        if (self.max_bytes and size > self.max_bytes) or self.max_entries <= 0:
+            # Would never fit, make sure a stale copy is not kept
+            self.pop(key)
+            return
+        if key in self._data:
+            self._remove(key)
+        expires = time.monotonic() + self.ttl if self.ttl else 0
+        self._data[key] = (value, size, expires)
+        self.size += size
+        while len(self._data) > self.max_entries or (self.max_bytes and self.size > self.max_bytes):
+            old, (old_value, old_size, _) = self._data.popitem(last=False)
+            self.size -= old_size
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(old, old_value)
+
+    def pop(self, key, default=None):
+        """
+        Removes a key and returns its value
+        """
+        if key not in self._data:
+            return default
+        return self._remove(key)
+
+    def clear(self):
+        """
+        Removes every entry
+        """
+        self._data.clear()
+        self.size = 0
+
+    def _remove(self, key):
+        value, size, _ = self._data.pop(key)
+        self.size -= size
+        return value
+
+    def stats(self):
+        """
+        Returns the cache counters as a dict
+        """
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'ratio': (self.hits / total) if total else 0.0,
+        }
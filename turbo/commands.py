@@ -1,23 +1,45 @@
 import asyncio
 import inspect
+import io
+import time
 import traceback
 import discord
 import random
 import re
-import subprocess
+import os
+import signal
 import logging
 import urllib.parse
+from asyncio.subprocess import PIPE, STDOUT
 
-from bs4 import BeautifulSoup
-from functools import wraps
-from discord.ext.commands.bot import _get_variable
 
+from .constants import SHARD_REPORT_INTERVAL
 from .exceptions import InvalidUsage, Shutdown
-from .utils import load_json
-from .constants import BACKUP_TAGS
+from .executor import EXECUTOR
+from .extract import ClassExtractor
+from .github import IssueIndex
+from .limits import limit
+from .permissions import require
+from .profiler import sample
 
 log = logging.getLogger(__name__)
 
+SUBPROCESS_TAIL = 1800  # characters of subprocess output that fit in one message
+SUBPROCESS_EDIT_INTERVAL = 2  # seconds between edits while a subprocess runs
+
+
+def kill_process(proc):
+    """
+    Kills a subprocess and anything it started
+    """
+    try:
+        if os.name == 'posix':
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+
 
 class Response:
 
@@ -42,6 +64,7 @@ class Commands:
         self.config = bot.config
         self.db = bot.db
         self.req = bot.req
+        self.issues = IssueIndex(self.req)
 
         self.can_change_name = True
 
@@ -49,51 +72,19 @@ class Commands:
         """
         Requires the bot to be running with the selfbot bool in the config set to True
         """
-        @wraps(func)
-        async def wrapper(self, *args, **kwargs):
-            message = _get_variable('message')
-
-            if not message or self.config.selfbot:
-                return await func(self, *args, **kwargs)
-            else:
-                return Response(":warning: This command can only be used with selfbots", delete=10)
-
-        return wrapper
+        return require(func, 'selfbot', ":warning: This command can only be used with selfbots")
 
     def requires_db(func):
         """
         Requires a database connection
         """
-        @wraps(func)
-        async def wrapper(self, *args, **kwargs):
-            message = _get_variable('message')
-
-            if not message or self.db.db is not None:
-                return await func(self, *args, **kwargs)
-            else:
-                return Response(":warning: This command cannot be used. Only read-only commands can be used while the database is unavailable", delete=10)
-
-        return wrapper
+        return require(func, 'db', ":warning: This command cannot be used. Only read-only commands can be used while the database is unavailable")
 
     def creator_only(func):
         """
         Requires the bot's application creator to be the one using the command
         """
-        @wraps(func)
-        async def wrapper(self, *args, **kwargs):
-            message = _get_variable('message')
-
-            if self.bot.user.bot:
-                owner = (await self.bot.application_info()).owner.id
-            else:
-                owner = self.bot.user.id
-
-            if not message or message.author.id == owner:
-                return await func(self, *args, **kwargs)
-            else:
-                return Response(":warning: This command cannot be used - only the bot application creator can use this command to prevent harm", delete=10)
-
-        return wrapper
+        return require(func, 'creator', ":warning: This command cannot be used - only the bot application creator can use this command to prevent harm")
 
     async def _discrim_timer(self):
         """
@@ -134,19 +125,16 @@ class Commands:
         If a command is given, it will give the docs for that command
         """
         if cmd:
-            h = getattr(self, 'c_%s' % cmd, None)
-            if not h:
+            command = self.bot.registry.get(cmd.lower())
+            if not command:
                 return Response(":warning: `{}` is not a valid command".format(cmd), delete=10)
-            docs = getattr(h, '__doc__', None)
-            docs = '\n'.join(l.strip() for l in docs.split('\n'))
-            return Response("```\n{}\n```".format(
-                docs.format(prefix=self.config.prefix)), reply=True, delete=60)
+            docs = command.doc
+            if command.aliases:
+                docs += "\nAliases: {}".format(', '.join(command.aliases))
+            return Response("```\n{}\n```".format(docs), reply=True, delete=60)
         else:
-            commands = []
-            for a in dir(self):
-                if a.startswith('c_'):
-                    cname = a.replace('c_', '').lower()
-                    commands.append("{}{}".format(self.config.prefix, cname))
+            commands = ["{}{}".format(self.config.prefix, c.name)
+                        for c in sorted(self.bot.registry, key=lambda c: c.name)]
             return Response("Commands:\n`{}`".format("`, `".join(commands)), delete=60)
 
     @creator_only
@@ -169,6 +157,7 @@ class Commands:
         log.debug("Evaluated: {} - Result was: {}".format(stmt, result))
         return Response("```xl\n--- In ---\n{}\n--- Out ---\n{}\n```".format(stmt, result))
 
+    @limit(5, 10, 'user')
     async def c_snowflake(self, author, id=None):
         """
         Get the creation time in UTC of a Discord ID
@@ -184,6 +173,7 @@ class Commands:
             else:
                 id = author.id
         preface = " "
+        kinds = ['user', 'channel', 'emoji', 'server', 'message']
         if '<' in id:
             # Assume that a numerical ID wasn't actually given
             for i in ['<', '>', '#', '@']:
@@ -193,10 +183,7 @@ class Commands:
                 # Assume that a role was provided
                 id = id.replace('&', '')
                 log.debug('Assuming role provided: ' + id)
-                for s in self.bot.servers:
-                    role = discord.utils.get(s.roles, id=id)
-                    if role:
-                        preface = " Role: **{} | {}**\n".format(s, role.name)
+                kinds.insert(0, 'role')
             if ':' in id:
                 # Assume that an emoji was provided
                 log.debug('Assuming emoji provided: ' + id)
@@ -212,22 +199,19 @@ class Commands:
             return Response(":warning: `{}` is not a valid ID".format(id), delete=10)
 
         # Try and resolve it to an object for no reason really
-        member = discord.utils.get(self.bot.get_all_members(), id=id)
-        if member:
-            preface = " User: **{}**\n".format(member)
-        channel = discord.utils.get(self.bot.get_all_channels(), id=id)
-        if channel:
-            preface = " Channel: **{0.server} | #{0.name}**\n".format(channel)
-        emoji = discord.utils.get(self.bot.get_all_emojis(), id=id)
-        if emoji:
-            preface = " Emote: **{}**\n".format(emoji.name)
-        server = discord.utils.get(self.bot.servers, id=id)
-        if server:
-            preface = " Server: **{}**\n".format(server)
-        message = discord.utils.get(self.bot.messages, id=id)
-        if message:
-            preface = " Message: Sent in **{0.server} | #{0.name}**\n".format(
-                message.channel)
+        # Later kinds take precedence when an ID is shared
+        prefaces = {
+            'role': lambda o: " Role: **{} | {}**\n".format(o.server, o.name),
+            'user': lambda o: " User: **{}**\n".format(o),
+            'channel': lambda o: " Channel: **{0.server} | #{0.name}**\n".format(o),
+            'emoji': lambda o: " Emote: **{}**\n".format(o.name),
+            'server': lambda o: " Server: **{}**\n".format(o),
+            'message': lambda o: " Message: Sent in **{0.server} | #{0.name}**\n".format(o.channel),
+        }
+        entities = self.bot.snowflakes.get(id)
+        for kind in kinds:
+            if kind in entities:
+                preface = prefaces[kind](entities[kind])
 
         snowflake = discord.utils.snowflake_time(sfid)
         time = snowflake.strftime("**%a %d %b %y** (**%X** UTC)")
@@ -264,8 +248,7 @@ class Commands:
             else:
                 discrim = author.discriminator
 
-        has_discrim = set(
-            [x.name for x in self.bot.get_all_members() if x.discriminator == discrim])
+        has_discrim = self.bot.discrims.get(discrim)
         if not has_discrim:
             return Response(":warning: No names with the discriminator `{}`".format(discrim), delete=10)
         return Response(":crayon: Names using `{}`\n`{}`".format(discrim, '`, `'.join(has_discrim)))
@@ -284,8 +267,7 @@ class Commands:
             return Response(":warning: This command only works when Password is set in the config", delete=10)
         if not self.can_change_name:
             return Response(":warning: This command cannot be used yet. It has not been 1 hour since last usage", delete=10)
-        has_discrim = list(set([x.name for x in self.bot.get_all_members(
-        ) if x.discriminator == author.discriminator and x.name != author.name]))
+        has_discrim = [x for x in self.bot.discrims.get(author.discriminator) if x != author.name]
         if not has_discrim:
             return Response(":warning: No names with the discriminator `{}`".format(author.discriminator), delete=10)
         name = random.choice(has_discrim)
@@ -311,14 +293,15 @@ class Commands:
         {prefix}tags
         """
         if not self.bot.dbfailed:
-            cursor = await self.db.get_db().table(self.bot.config.dbtable_tags).run(self.db.db)
-            if not cursor.items:
+            tags = await self.db.get_tag_names()
+            if not tags:
                 return Response(":warning: No tags exist (yet)", delete=10)
-            tags = [x['name'] for x in cursor.items]
+            tags = sorted(tags)
         else:
-            tags = load_json(BACKUP_TAGS)
+            tags = await self.bot.backup.load()
             if not tags:
                 return Response(":warning: No tags found in the backup tags file", delete=10)
+            tags = sorted(tags)
         return Response(":pen_ballpoint: **Tags**\n`{}`".format('`, `'.join(tags)), delete=60)
 
     @requires_db
@@ -363,17 +346,17 @@ class Commands:
         content = message.content.replace(
             '{}tag '.format(self.config.prefix), '')
         if not self.bot.dbfailed:
-            get = await self.db.get_db().table(self.bot.config.dbtable_tags).get(content).run(self.db.db)
+            get = await self.db.get_tag(content)
             if get is None:
                 return Response(":warning: No tag named `{}`".format(content), delete=10)
             else:
-                return Response(get['content'])
+                return Response(get)
         else:
-            get = load_json(BACKUP_TAGS)
+            get = await self.bot.backup.load()
             if not get:
                 return Response(":warning: No tags found in the backup tags file", delete=10)
             else:
-                get = get.get(content, default=None)
+                get = get.get(content)
                 if get is None:
                     return Response(":warning: No tag with that name in the backup tags file", delete=10)
                 else:
@@ -389,64 +372,185 @@ class Commands:
         await self.db.delete(self.bot.config.dbtable_tags)
         return Response(":thumbsup:", delete=10)
 
-    async def c_stats(self):
+    @limit(2, 10, 'channel', concurrency=1)
+    async def c_stats(self, option=None):
         """
         Prints statistics
+
+        {prefix}stats [recount]
+
+        Use recount to verify the counters against a full recount
         """
+        stats = self.bot.stats
         response = "```xl"
 
+        if option is not None:
+            if option.lower() != 'recount':
+                raise InvalidUsage()
+            drift = await stats.verify(self.bot.servers)
+            response += "\nRecounted: {}".format(
+                ', '.join("{} {} -> {}".format(k, *v) for k, v in drift.items()) or "no drift")
+
         # Bot
         m, s = divmod(int(self.bot.get_uptime()), 60)
         h, m = divmod(m, 60)
         response += "\nUptime: %d:%02d:%02d" % (h, m, s)
+        response += "\nCommands: {} ({:.2f}/min)".format(stats.commands, stats.throughput())
+        if stats.commands:
+            response += "\nDispatch: {:.1f}ms avg, {:.1f}ms max".format(
+                stats.dispatch_time / stats.commands * 1000, stats.dispatch_max * 1000)
 
         # User
-        response += "\n\nUsers: {} ({} unique)".format(
-            len(list(self.bot.get_all_members())), len(set(self.bot.get_all_members())))
-        response += "\nAvatars: {} ({} unique)".format(
-            len([x for x in self.bot.get_all_members() if x.avatar]), len(set([x for x in self.bot.get_all_members() if x.avatar])))
-        response += "\nBots: {} ({} unique)".format(
-            len([x for x in self.bot.get_all_members() if x.bot]), len(set([x for x in self.bot.get_all_members() if x.bot])))
+        response += "\n\nUsers: {} ({} unique)".format(stats.members, stats.users)
+        response += "\nAvatars: {} ({} unique)".format(stats.avatar_members, stats.avatar_users)
+        response += "\nBots: {} ({} unique)".format(stats.bot_members, stats.bot_users)
 
         # Server
-        response += "\n\nServers: {}".format(len(self.bot.servers))
-        response += "\nRequires 2FA: {}".format(
-            len([x for x in self.bot.servers if x.mfa_level == 1]))
-        response += "\nHas Emojis: {}".format(
-            len([x for x in self.bot.servers if x.emojis]))
+        response += "\n\nServers: {}".format(stats.servers)
+        response += "\nRequires 2FA: {}".format(stats.mfa_servers)
+        response += "\nHas Emojis: {}".format(stats.emoji_servers)
 
         # Other
         response += "\n\nPMs: {}".format(len(self.bot.private_channels))
+
+        # Shards
+        if self.bot.shard_count is not None:
+            response += "\n\nShard: {} of {}".format(self.bot.shard_id + 1, self.bot.shard_count)
+            if not self.bot.dbfailed:
+                try:
+                    shards = await self.db.get_shards(self.bot.shard_count, SHARD_REPORT_INTERVAL * 3)
+                except Exception as e:
+                    log.warning("Could not get shard stats: %s", e)
+                    shards = []
+                if shards:
+                    totals = {k: sum(s.get(k, 0) for s in shards) for k in ('servers', 'members', 'commands')}
+                    response += " ({} reporting)".format(len(shards))
+                    response += "\nAll Shards: {servers} servers, {members} members, {commands} commands".format(**totals)
+
+        # HTTP
+        http = self.req.stats()
+        response += "\n\nHTTP Requests: {requests} ({errors} errors, {timeouts} timeouts)".format(**http)
+        response += "\nIn Flight: {in_flight} (peak {peak}, {coalesced} shared)".format(**http)
+        if self.req.cache is not None:
+            cache = self.req.cache.stats()
+            response += "\nHTTP Cache: {ratio:.0%} hit ratio, {bytes_saved} bytes saved".format(**cache)
+
+        # Outbound
+        out = self.bot.outbound.stats()
+        response += "\n\nOutbound: {requests} requests ({merged} merged, {paced} paced)".format(**out)
+        response += "\nQueued: {depth} | Wait: {avg:.1f}ms avg, {max:.1f}ms max".format(
+            avg=out['wait_avg'] * 1000, max=out['wait_max'] * 1000, **out)
+
+        # Tag cache
+        cache = self.db.tag_cache.stats()
+        response += "\n\nTag Cache: {entries} tags ({bytes} bytes)".format(**cache)
+        response += "\nCache Hits: {hits} | Misses: {misses} | Evictions: {evictions}".format(**cache)
+
+        # Executor
+        response += "\n\nExecutor: {kind} ({workers} workers, {submitted} tasks)".format(**EXECUTOR.stats())
+
+        # Event loop
+        lag = self.bot.lag
+        response += "\n\nLoop Stalls: {}".format(lag.stalls)
+        if lag.stalls:
+            response += " (worst {:.2f}s, {})".format(lag.worst, lag.worst_where)
         response += "\n```"
         return Response(response)
 
     @creator_only
-    async def c_subprocess(self, args):
+    @limit(concurrency=1)
+    async def c_profile(self, channel, seconds=None):
+        """
+        Samples what the bot is doing and uploads the profile
+
+        {prefix}profile [seconds]
+
+        Samples for 10 seconds by default, and at most 60
+        The file has one collapsed stack per line for flamegraph.pl or speedscope
+        """
+        try:
+            seconds = min(float(seconds or 10), 60)
+        except ValueError:
+            raise InvalidUsage()
+        counts = await self.bot.loop.run_in_executor(None, sample, seconds)
+        profile = '\n'.join("{} {}".format(stack, n) for stack, n in counts.most_common())
+        await self.bot.send_file(
+            channel, io.BytesIO(profile.encode()), filename='profile-{}.txt'.format(int(time.time())),
+            content=":fire: {} samples over {:g}s".format(sum(counts.values()), seconds))
+
+    @creator_only
+    @limit(concurrency=2)
+    async def c_subprocess(self, message, args):
         """
         Uses subprocess to run a console command
         This should not be used if you do not know what you're doing
         This makes it easier to update the bot and perform actions
         Without having to SSH into the bot itself
+        Output is shown while the command runs, and it is killed after SubprocessTimeout
 
-        {prefix}subprocess
+        {prefix}subprocess <command>
         """
         if not args:
             raise InvalidUsage()
         try:
-            output = subprocess.Popen(' '.join(args), shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            proc = await asyncio.create_subprocess_shell(
+                ' '.join(args), stdout=PIPE, stderr=STDOUT, start_new_session=(os.name == 'posix'))
         except Exception as e:
-            output = e
-        while output is not None:
-            retcode = output.poll()
-            if retcode is not None:
-                # done
-                output = output.communicate()[0].decode()
-                break
+            return Response("```xl\n--- Subprocess ---\n{}\n```".format(e))
+
+        output = bytearray()
+        state = {'reply': None, 'edit': None, 'truncated': False}
+        maxoutput = self.config.subprocessmaxoutput
+
+        def render(status):
+            text = output.decode(errors='replace')
+            if state['truncated']:
+                text += "\n[Output past {} bytes was discarded]".format(maxoutput)
+            if len(text) > SUBPROCESS_TAIL:
+                text = "..." + text[-SUBPROCESS_TAIL:]
+            text = "```xl\n--- Subprocess ({}) ---\n{}\n```".format(status, text.replace('```', '`\u200b``'))
+            return self.bot.format_response(message, Response(text))
+
+        async def show(status):
+            if state['reply'] is None:
+                # Edited as output arrives, so it can't have other replies merged in
+                state['reply'] = await self.bot.respond(message, render(status), merge=False)
             else:
-                # still running
-                await asyncio.sleep(1)
-        return Response("```xl\n--- Subprocess ---\n{}\n```".format(output))
+                await self.bot.edit_message(state['reply'], render(status))
+
+        async def read():
+            last = self.bot.loop.time()
+            while True:
+                chunk = await proc.stdout.read(4096)
+                if not chunk:
+                    break
+                room = maxoutput - len(output)
+                if len(chunk) > room:
+                    # Keep draining so the process doesn't block on a full pipe
+                    state['truncated'] = True
+                    chunk = chunk[:max(room, 0)]
+                output.extend(chunk)
+                now = self.bot.loop.time()
+                pending = state['edit']
+                if now - last >= SUBPROCESS_EDIT_INTERVAL and (pending is None or pending.done()):
+                    last = now
+                    state['edit'] = asyncio.ensure_future(show('running'))
+            return await proc.wait()
 
+        try:
+            code = await asyncio.wait_for(read(), self.config.subprocesstimeout or None)
+            status = "exit code {}".format(code)
+        except asyncio.TimeoutError:
+            kill_process(proc)
+            await proc.wait()
+            status = "killed after {}s".format(self.config.subprocesstimeout)
+        log.debug("Subprocess finished with %s", status)
+
+        if state['edit'] is not None:
+            await state['edit']
+        await show(status)
+
+    @limit(3, 10, 'channel')
     async def c_cat(self):
         """
         Sends a random cat picture
@@ -456,6 +560,8 @@ class Commands:
         cat = await self.req.get('http://random.cat/meow')
         return Response(cat['file'])
 
+    @limit(3, 30, 'user')
+    @limit(10, 30, 'server', concurrency=5)
     async def c_youtube(self, args):
         """
         Searches YouTube from given query
@@ -468,14 +574,10 @@ class Commands:
 
         args = ' '.join(args)
         search = urllib.parse.quote(args)
-        html = await self.req.get('https://www.youtube.com/results?search_query=' + search, json=False)
-        soup = BeautifulSoup(html, "html.parser")
+        parser = ClassExtractor('yt-uix-tile-link', 5, required=('href', 'title'))
+        await self.req.feed('https://www.youtube.com/results?search_query=' + search, parser)
         response = "YouTube results for **{}**".format(args)
-        amount = 5
-        for l in soup.findAll(attrs={'class': 'yt-uix-tile-link'}):
-            if amount <= 0:
-                break
-
+        for l in parser.results:
             prefix = ":clapper: "
             if '/user/' in l['href'] or '/channel/' in l['href']:
                 prefix = ":bust_in_silhouette: "
@@ -483,7 +585,6 @@ class Commands:
                 prefix = ':book: '
 
             response += "\n{0}`{1}` - <https://youtube.com{2}>".format(prefix, l['title'], l['href'])
-            amount -= 1
         return Response(response)
 
     async def c_presence(self, author, option=None):
@@ -510,11 +611,15 @@ class Commands:
         else:
             raise InvalidUsage()
 
+    @limit(3, 30, 'user')
+    @limit(10, 60, 'server', concurrency=3)
     async def c_ghissue(self, repo, args):
         """
         Returns the top GitHub issue results in a repo for a query
 
         {prefix}ghissue <repo> <query>
+
+        Open issues are ranked by relevance, allowing for typos
         """
         if not args:
             raise InvalidUsage()
@@ -523,16 +628,10 @@ class Commands:
         if '/' not in repo:
             return Response(":warning: The repository name should be formatted like: `hammerandchisel/discord-api-docs`", delete=10)
 
-        url = "https://api.github.com/repos/{0}/issues".format(repo)
-        req = await self.req.get(url, json=True)
-
-        matching = []
-        for i in req:
-            if args.lower() in i['title'].lower():
-                matching.append(i)
-            elif args.lower() in i['body'].lower():
-                matching.append(i)
-            # TODO: Fuzzy searching
+        try:
+            matching = await self.issues.search(repo, args)
+        except LookupError as e:
+            return Response(":warning: Could not get issues for `{}`: {}".format(repo, e), delete=10)
 
         if not matching:
             return Response(":no_entry_sign: No results found in `{}` for `{}`".format(repo, args), delete=10)
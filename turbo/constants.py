@@ -2,3 +2,5 @@ VERSION = "2.1"
 USER_AGENT = "Turbo {0} (github.com/jaydenkieran/Turbo) discord.py/aiohttp".format(
     VERSION)
 BACKUP_TAGS = "data/backup_tags.json"
+PENDING_DELETIONS = "data/pending_deletions.json"
+SHARD_REPORT_INTERVAL = 60  # seconds between saving each shard's stats
@@ -1,6 +1,11 @@
+import asyncio
 import logging
+import time
 import rethinkdb as r
 
+from .cache import LRUCache
+from .metrics import QUERIES
+
 log = logging.getLogger(__name__)
 
 
@@ -13,32 +18,222 @@ class Database():
         r.set_loop_type("asyncio")
         self.ready = False
 
+        config = self.bot.config
+        self.tags_table = config.dbtable_tags
+        self.shards_table = config.dbtable_shards
+        self.tag_cache = LRUCache(config.tagcachesize, config.tagcachebytes, config.tagcachettl)
+        self._tag_names = None  # set of all tag names once loaded
+
+        self.live_tags = None  # name -> content, mirrored from the changefeed
+        self._feed = None
+
     def get_db(self):
         """
         Returns the RethinkDB module/instance
         """
         return r
 
+    async def run(self, query, operation):
+        """
+        Runs a query, recording how long it took under the operation name
+        """
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = await query.run(self.db)
+            outcome = 'ok'
+            return result
+        finally:
+            QUERIES.labels(operation, outcome).observe(time.perf_counter() - start)
+
     async def insert(self, table, data):
         """
         Insert a document into a table
         """
-        log.debug(
-            "Saving document to table {} with data: {}".format(table, data))
-        return await r.table(table).insert(data, conflict="update").run(self.db)
+        log.debug("Saving document to table %s with data: %s", table, data)
+        result = await self.run(r.table(table).insert(data, conflict="update"), 'insert')
+        if table == self.tags_table:
+            self._cache_tag(data['name'], data['content'])
+        return result
 
     async def delete(self, table, primary_key=None):
         """
         Deletes a document(s) from a table
         """
-        log.debug(
-            "Deleting document from table {} with primary key {}".format(table, primary_key))
+        log.debug("Deleting document from table %s with primary key %s", table, primary_key)
         if primary_key is not None:
             # Delete one document with the key name
-            return await r.table(table).get(primary_key).delete().run(self.db)
+            result = await self.run(r.table(table).get(primary_key).delete(), 'delete')
+            if table == self.tags_table:
+                self._uncache_tag(primary_key)
         else:
             # Delete all documents in the table
-            return await r.table(table).delete().run(self.db)
+            result = await self.run(r.table(table).delete(), 'delete_all')
+            if table == self.tags_table:
+                self.tag_cache.clear()
+                self._tag_names = set()
+                if self.live_tags is not None:
+                    self.live_tags.clear()
+                if self.bot.config.backuptags:
+                    self.bot.backup.clear()
+        return result
+
+    async def each(self, query, callback):
+        """
+        Runs a query and calls callback with each document as the cursor is read
+        Returns the amount of documents read
+        """
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            cursor = await query.run(self.db)
+            count = 0
+            while (await cursor.fetch_next()):
+                callback(await cursor.next())
+                count += 1
+            outcome = 'ok'
+            return count
+        finally:
+            QUERIES.labels('each', outcome).observe(time.perf_counter() - start)
+
+    async def fetch_all(self, query):
+        """
+        Runs a query and reads every document from the returned cursor
+        """
+        docs = []
+        await self.each(query, docs.append)
+        return docs
+
+    async def get_tag(self, name):
+        """
+        Returns the content of a tag, or None if it does not exist
+        Served from the live tags or tag cache when possible
+        """
+        if self.live_tags is not None:
+            return self.live_tags.get(name)
+        content = self.tag_cache.get(name)
+        if content is not None:
+            return content
+        doc = await self.run(r.table(self.tags_table).get(name), 'get_tag')
+        if doc is None:
+            return None
+        self.tag_cache.put(name, doc['content'])
+        return doc['content']
+
+    async def get_tag_names(self):
+        """
+        Returns every tag name
+        The table is only read the first time, later writes keep it current
+        """
+        if self.live_tags is not None:
+            return self.live_tags.keys()
+        if self._tag_names is None:
+            docs = await self.fetch_all(r.table(self.tags_table).pluck('name'))
+            self._tag_names = set(d['name'] for d in docs)
+        return self._tag_names
+
+    async def backup_tags(self, store):
+        """
+        Streams every tag into a JsonStore and saves it
+        Returns the amount of tags backed up
+        """
+        await store.load()
+        data = store.data
+
+        def add(doc):
+            data[doc['name']] = doc['content']
+
+        count = await self.each(r.table(self.tags_table), add)
+        await store.save()
+        return count
+
+    async def get_shards(self, shard_count, max_age):
+        """
+        Returns the stats last reported by each shard of a deployment
+        Reports older than max_age seconds are left out
+        """
+        docs = await self.fetch_all(r.table(self.shards_table))
+        oldest = time.time() - max_age
+        return [d for d in docs if d.get('shard_count') == shard_count and d.get('updated', 0) >= oldest]
+
+    def _cache_tag(self, name, content):
+        self.tag_cache.put(name, content)
+        if self._tag_names is not None:
+            self._tag_names.add(name)
+        if self.live_tags is not None:
+            self.live_tags[name] = content
+        if self.bot.config.backuptags:
+            self.bot.backup.set(name, content)
+
+    def _uncache_tag(self, name):
+        self.tag_cache.pop(name)
+        if self._tag_names is not None:
+            self._tag_names.discard(name)
+        if self.live_tags is not None:
+            self.live_tags.pop(name, None)
+        if self.bot.config.backuptags:
+            self.bot.backup.remove(name)
+
+    def watch_tags(self):
+        """
+        Starts mirroring the tags table in memory using a changefeed
+        """
+        if self._feed is None or self._feed.done():
+            self._feed = asyncio.ensure_future(self._watch_tags())
+
+    def stop_watching_tags(self):
+        """
+        Stops the changefeed started by watch_tags
+        """
+        if self._feed is not None:
+            self._feed.cancel()
+            self._feed = None
+        self.live_tags = None
+
+    async def _watch_tags(self):
+        """
+        Applies changes from the tags table to live_tags
+        Reconnects with backoff when the feed drops and resyncs fully afterwards
+        """
+        backoff = 1
+        while True:
+            try:
+                if not self.db.is_open():
+                    log.info("Reconnecting to database for the tags changefeed")
+                    await self.db.reconnect(noreply_wait=False)
+                query = r.table(self.tags_table).changes(include_initial=True, include_states=True)
+                cursor = await query.run(self.db)
+                # Initial values are collected separately so reads keep using the
+                # previous state until the resync has finished
+                tags = {}
+                while (await cursor.fetch_next()):
+                    change = await cursor.next()
+                    state = change.get('state')
+                    if state is not None:
+                        if state == 'ready':
+                            self.live_tags = tags
+                            self.tag_cache.clear()
+                            self._tag_names = None
+                            backoff = 1
+                            log.info("Tags changefeed is ready (%s tags)", len(tags))
+                        continue
+                    old, new = change.get('old_val'), change.get('new_val')
+                    if old is not None:
+                        tags.pop(old['name'], None)
+                    if new is not None:
+                        tags[new['name']] = new['content']
+                log.warning("Tags changefeed closed")
+            except asyncio.CancelledError:
+                raise
+            except (r.errors.ReqlError, OSError) as e:
+                log.warning("Tags changefeed dropped: %s", e)
+            except Exception:
+                # Anything else would end the feed for good, leaving live_tags stale
+                log.exception("Problem in the tags changefeed")
+            self.live_tags = None
+            log.debug("Retrying tags changefeed in %ss", backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
 
     async def connect(self, host, port, user, password):
         """
@@ -0,0 +1,99 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+log = logging.getLogger(__name__)
+
+KINDS = ('thread', 'process', 'inline')
+
+# Process pools take a start method from Python 3.7, before that they always fork
+SPAWN = sys.version_info >= (3, 7)
+
+
+def offload(func):
+    """
+    Makes a function run in the executor, calling it returns a future
+    Process pools are sent the function by name, so it should be in a module that
+    doesn't import the bot (see turbo.tasks), and take and return plain data
+    """
+    @functools.wraps(func)
+    def wrapper(*args):
+        return EXECUTOR.submit(func, args)
+    wrapper.inline = func
+    return wrapper
+
+
+class Executor:
+
+    """
+    Pool that CPU-heavy work is sent to, so the event loop is not blocked by it
+    """
+
+    def __init__(self, kind='thread', workers=0):
+        self.pool = None
+        self.submitted = 0
+        self.configure(kind, workers)
+
+    def configure(self, kind='thread', workers=0):
+        """
+        Sets the type of pool and the amount of workers (0 for one per CPU)
+        """
+        if kind not in KINDS:
+            raise ValueError("{} is not an executor type".format(kind))
+        self.shutdown()
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+
+    def _get_pool(self):
+        if self.pool is None:
+            if self.kind == 'process':
+                kwargs = {}
+                if SPAWN:
+                    # Workers are started fresh instead of forked, forking copies
+                    # the bot's threads' locks in whatever state they are in
+                    kwargs['mp_context'] = multiprocessing.get_context('spawn')
+                self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, **kwargs)
+            else:
+                self.pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+            log.debug("Started a %s pool with %s workers", self.kind, self.workers)
+        return self.pool
+
+    def submit(self, func, args):
+        """
+        Runs a function with args in the pool and returns a future for its result
+        """
+        loop = asyncio.get_event_loop()
+        self.submitted += 1
+        if self.kind == 'inline':
+            future = loop.create_future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        try:
+            return loop.run_in_executor(self._get_pool(), func, *args)
+        except BrokenProcessPool:
+            # A worker died, start a new pool
+            log.warning("Process pool is broken, restarting it")
+            self.pool = None
+            return loop.run_in_executor(self._get_pool(), func, *args)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def stats(self):
+        """
+        Returns the executor settings and usage as a dict
+        """
+        return {'kind': self.kind, 'workers': self.workers, 'submitted': self.submitted}
+
+
+EXECUTOR = Executor()
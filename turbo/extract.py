@@ -0,0 +1,43 @@
+import codecs
+import logging
+
+from html.parser import HTMLParser
+
+log = logging.getLogger(__name__)
+
+
+class ClassExtractor(HTMLParser):
+
+    """
+    Incremental HTML parser collecting the attributes of tags with a class
+    Fed raw chunks as they arrive and reports once enough results are found
+    """
+
+    def __init__(self, cls, limit, required=()):
+        super().__init__(convert_charrefs=True)
+        self.cls = cls
+        self.limit = limit
+        self.required = required
+        self.results = []
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    @property
+    def done(self):
+        return len(self.results) >= self.limit
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = dict(attrs)
+        if self.cls not in (attrs.get('class') or '').split():
+            return
+        if all(attrs.get(a) is not None for a in self.required):
+            self.results.append(attrs)
+
+    def feed_bytes(self, chunk):
+        """
+        Feeds a chunk of the response body
+        Returns True when no more input is needed
+        """
+        self.feed(self._decoder.decode(chunk))
+        return self.done
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+import urllib.parse
+
+from . import tasks
+from .cache import LRUCache
+from .executor import offload
+from .tasks import issue_terms
+
+log = logging.getLogger(__name__)
+
+API = "https://api.github.com/repos/{0}/issues"
+
+analyse = offload(tasks.analyse_issues)
+rank = offload(tasks.rank_issues)
+
+
+class RepoIssues:
+
+    """
+    Open issues of a repository with an inverted index over their text
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.issues = {}  # number -> issue
+        self.terms = {}  # number -> {token: weighted term frequency}
+        self.lengths = {}  # number -> weighted amount of tokens
+        self.postings = {}  # token -> set of numbers
+        self.total_length = 0
+        self.since = None  # newest updated_at seen
+        self.fetched = 0
+
+    def add(self, issue, terms=None):
+        """
+        Adds or replaces an issue, dropping it if it is no longer open
+        terms can be given if they were already worked out with issue_terms
+        """
+        number = issue['number']
+        self.remove(number)
+        updated = issue.get('updated_at')
+        if updated and (self.since is None or updated > self.since):
+            self.since = updated
+        if issue.get('state') != 'open':
+            return
+
+        if terms is None:
+            terms = issue_terms(issue.get('title'), issue.get('body'))
+        self.issues[number] = {k: issue.get(k) for k in ('number', 'state', 'title', 'html_url')}
+        self.terms[number] = terms
+        self.lengths[number] = sum(terms.values())
+        self.total_length += self.lengths[number]
+        for t in terms:
+            posting = self.postings.get(t)
+            if posting is None:
+                posting = self.postings[t] = set()
+            posting.add(number)
+
+    def remove(self, number):
+        terms = self.terms.pop(number, None)
+        if terms is None:
+            return
+        del self.issues[number]
+        self.total_length -= self.lengths.pop(number)
+        for t in terms:
+            posting = self.postings[t]
+            posting.discard(number)
+            if not posting:
+                del self.postings[t]
+
+    async def search(self, query, limit=10):
+        """
+        Ranks open issues against a query with BM25 in the executor
+        Returns a list of issues, best first
+
+        The index must not change until it returns, see IssueIndex.search
+        """
+        if not self.issues:
+            return []
+        numbers = await rank(self.issues, self.terms, self.lengths, self.postings, self.total_length, query, limit)
+        return [self.issues[i] for i in numbers]
+
+
+class IssueIndex:
+
+    """
+    Fetches and indexes GitHub issues per repository
+    Repeat queries are answered locally, refreshing with only updated issues
+    """
+
+    def __init__(self, req, *, fanout=4, per_page=100, max_pages=20, refresh=300, repos=20):
+        self.req = req
+        self.fanout = fanout
+        self.per_page = per_page
+        self.max_pages = max_pages  # per fetch, so huge repositories can't use up the rate limit
+        self.refresh = refresh
+        self.repos = LRUCache(max_entries=repos, sizeof=lambda k, v: 0)
+        self._locks = {}  # repo -> [lock, tasks using it], only kept while in use
+
+    async def get(self, repo):
+        """
+        Returns the indexed issues for a repository, fetching or refreshing them
+        """
+        return await self._with_index(repo)
+
+    async def search(self, repo, query, limit=10):
+        """
+        Returns the open issues of a repository best matching a query
+        The repository stays locked while ranking, so a refresh can't change
+        the index while the executor reads it
+        """
+        return await self._with_index(repo, lambda index: index.search(query, limit))
+
+    async def _with_index(self, repo, func=None):
+        """
+        Fetches or refreshes the issues for a repository with it locked
+        Returns the index, or what awaiting func(index) returns before unlocking
+        """
+        repo = repo.lower()
+        entry = self._locks.get(repo)
+        if entry is None:
+            entry = self._locks[repo] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                index = self.repos.get(repo)
+                if index is None:
+                    index = RepoIssues(repo)
+                    await self._fetch(index, {'state': 'open'})
+                    self.repos.put(repo, index)
+                elif time.monotonic() - index.fetched > self.refresh:
+                    if index.since is None:
+                        # Nothing was fetched, so there is nothing to update and
+                        # state=all without since would page through every closed issue
+                        await self._fetch(index, {'state': 'open'})
+                    else:
+                        # Closed issues are included so they can be dropped from the index
+                        await self._fetch(index, {'state': 'all', 'since': index.since})
+                if func is not None:
+                    return await func(index)
+                return index
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[repo]
+
+    async def _fetch(self, index, params):
+        """
+        Fetches every page of issues, up to fanout pages at a time
+        Stops after max_pages, keeping the issues fetched so far
+        """
+        url = API.format(index.repo)
+        params = dict(params, per_page=self.per_page)
+        query = urllib.parse.urlencode(sorted((k, v) for k, v in params.items() if v is not None))
+        page = 1
+        count = 0
+        while True:
+            if page > self.max_pages:
+                log.warning("Stopped fetching issues for %s after %s pages", index.repo, self.max_pages)
+                break
+            pages = range(page, min(page + self.fanout, self.max_pages + 1))
+            results = await asyncio.gather(*[
+                self.req.get("{}?{}&page={}".format(url, query, p), json=True) for p in pages])
+            last = False
+            for r in results:
+                if isinstance(r, dict):
+                    raise LookupError(r.get('message', 'Unexpected response from GitHub'))
+                # Tokenizing is done in the executor, only the text is sent
+                terms = await analyse([(i.get('title'), i.get('body')) for i in r if i.get('state') == 'open'])
+                terms = iter(terms)
+                for issue in r:
+                    index.add(issue, next(terms) if issue.get('state') == 'open' else None)
+                count += len(r)
+                if len(r) < self.per_page:
+                    last = True
+            if last:
+                break
+            page += self.fanout
+        index.fetched = time.monotonic()
+        log.debug("Fetched %s issues for %s", count, index.repo)
@@ -0,0 +1,168 @@
+import logging
+
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class DiscrimIndex:
+
+    """
+    Maps discriminators to the names of visible members using them
+    Built once after ready and kept current from member events
+    """
+
+    def __init__(self):
+        self.discrims = {}  # discrim -> {name: amount of members}
+
+    def build(self, members):
+        """
+        Rebuilds the index from an iterable of members
+        """
+        self.discrims = {}
+        for m in members:
+            self.add(m)
+        log.debug("Indexed %s discriminators", len(self.discrims))
+
+    def add(self, member):
+        names = self.discrims.get(member.discriminator)
+        if names is None:
+            names = self.discrims[member.discriminator] = {}
+        names[member.name] = names.get(member.name, 0) + 1
+
+    def remove(self, member):
+        names = self.discrims.get(member.discriminator)
+        if not names:
+            return
+        count = names.get(member.name, 0) - 1
+        if count > 0:
+            names[member.name] = count
+        else:
+            names.pop(member.name, None)
+            if not names:
+                del self.discrims[member.discriminator]
+
+    def update(self, before, after):
+        if before.name != after.name or before.discriminator != after.discriminator:
+            self.remove(before)
+            self.add(after)
+
+    def add_server(self, server):
+        for m in server.members:
+            self.add(m)
+
+    def remove_server(self, server):
+        for m in server.members:
+            self.remove(m)
+
+    def get(self, discrim):
+        """
+        Returns the names using a discriminator
+        """
+        names = self.discrims.get(discrim)
+        return names.keys() if names else ()
+
+
+class SnowflakeIndex:
+
+    """
+    Maps snowflake IDs to the entities using them
+    Covers users, channels, emojis, roles, servers and cached messages
+    """
+
+    def __init__(self, max_messages=5000):
+        self.max_messages = max_messages
+        self.entities = {}  # id -> {kind: object}
+        self._members = {}  # user id -> amount of servers the user is visible in
+        self._messages = OrderedDict()  # message ids in cache order
+
+    def build(self, servers, messages=()):
+        """
+        Rebuilds the index from the bot's servers and message cache
+        """
+        self.entities = {}
+        self._members = {}
+        self._messages = OrderedDict()
+        for s in servers:
+            self.add_server(s)
+        for m in messages:
+            self.add_message(m)
+        log.debug("Indexed %s snowflakes", len(self.entities))
+
+    def get(self, id):
+        """
+        Returns a dict of kind -> object for an ID
+        """
+        return self.entities.get(id, {})
+
+    def add(self, kind, obj):
+        kinds = self.entities.get(obj.id)
+        if kinds is None:
+            kinds = self.entities[obj.id] = {}
+        kinds[kind] = obj
+
+    def remove(self, kind, obj):
+        kinds = self.entities.get(obj.id)
+        if kinds is None:
+            return
+        kinds.pop(kind, None)
+        if not kinds:
+            del self.entities[obj.id]
+
+    def add_member(self, member):
+        self._members[member.id] = self._members.get(member.id, 0) + 1
+        self.add('user', member)
+
+    def remove_member(self, member):
+        count = self._members.get(member.id, 0) - 1
+        if count > 0:
+            self._members[member.id] = count
+        else:
+            self._members.pop(member.id, None)
+            self.remove('user', member)
+
+    def add_server(self, server):
+        self.add('server', server)
+        for c in server.channels:
+            self.add('channel', c)
+        for r in server.roles:
+            self.add('role', r)
+        for e in server.emojis:
+            self.add('emoji', e)
+        for m in server.members:
+            self.add_member(m)
+
+    def remove_server(self, server):
+        self.remove('server', server)
+        for c in server.channels:
+            self.remove('channel', c)
+        for r in server.roles:
+            self.remove('role', r)
+        for e in server.emojis:
+            self.remove('emoji', e)
+        for m in server.members:
+            self.remove_member(m)
+
+    def update_emojis(self, before, after):
+        for e in before:
+            self.remove('emoji', e)
+        for e in after:
+            self.add('emoji', e)
+
+    def add_message(self, message):
+        self.add('message', message)
+        self._messages[message.id] = None
+        while len(self._messages) > self.max_messages:
+            old, _ = self._messages.popitem(last=False)
+            self._remove_message_id(old)
+
+    def remove_message(self, message):
+        if self._messages.pop(message.id, 0) is None:
+            self._remove_message_id(message.id)
+
+    def _remove_message_id(self, id):
+        kinds = self.entities.get(id)
+        if kinds is not None:
+            kinds.pop('message', None)
+            if not kinds:
+                del self.entities[id]
@@ -0,0 +1,123 @@
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+SCOPES = {
+    'user': lambda m: m.author.id,
+    'channel': lambda m: m.channel.id,
+    'server': lambda m: m.server.id if m.server else m.channel.id,
+}
+
+
+class Cooldown:
+
+    """
+    Token bucket allowing rate uses every per seconds, for each user/channel/server
+    """
+
+    def __init__(self, rate, per, scope='user', max_keys=10000):
+        if scope not in SCOPES:
+            raise ValueError("{} is not a cooldown scope".format(scope))
+        self.rate = rate
+        self.per = per
+        self.scope = scope
+        self.max_keys = max_keys
+        self._key = SCOPES[scope]
+        self._buckets = {}  # key -> (tokens, last update)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, key, now):
+        entry = self._buckets.get(key)
+        if entry is None:
+            return self.rate
+        return min(self.rate, entry[0] + (now - entry[1]) * self.rate / self.per)
+
+    def retry_after(self, message, now=None):
+        """
+        Returns 0 if the message's scope has a token, otherwise the seconds until it would
+        Does not use the token
+        """
+        tokens = self._tokens(self._key(message), now or time.monotonic())
+        if tokens < 1:
+            return (1 - tokens) * self.per / self.rate
+        return 0
+
+    def hit(self, message, now=None):
+        """
+        Uses a token for the message's scope
+        Returns 0 if allowed, otherwise the seconds until it would be
+        """
+        now = now or time.monotonic()
+        key = self._key(message)
+        tokens = self._tokens(key, now)
+        if tokens < 1:
+            return (1 - tokens) * self.per / self.rate
+        if key not in self._buckets and len(self._buckets) >= self.max_keys:
+            self.expire(now)
+        self._buckets[key] = (tokens - 1, now)
+        return 0
+
+    def expire(self, now=None):
+        """
+        Forgets keys whose buckets have refilled, as they are the same as new keys
+        """
+        now = now or time.monotonic()
+        idle = [k for k, (tokens, last) in self._buckets.items()
+                if tokens + (now - last) * self.rate / self.per >= self.rate]
+        for k in idle:
+            del self._buckets[k]
+        log.debug("Expired %s idle cooldown keys", len(idle))
+
+
+class Limit:
+
+    """
+    Cooldowns and a cap on concurrent uses declared for a command
+    """
+
+    def __init__(self, cooldowns=(), concurrency=0):
+        self.cooldowns = list(cooldowns)
+        self.concurrency = concurrency
+        self.running = 0
+
+    def acquire(self, message):
+        """
+        Starts a use of the command
+        Returns a reason if it is not allowed, otherwise None and release must be called
+        """
+        if self.concurrency and self.running >= self.concurrency:
+            return "is busy, try again shortly"
+        # Every cooldown is checked before any token is used, so a use rejected by
+        # one scope doesn't count against the others
+        now = time.monotonic()
+        for c in self.cooldowns:
+            retry = c.retry_after(message, now)
+            if retry:
+                return "is on cooldown, try again in {:.1f}s".format(retry)
+        for c in self.cooldowns:
+            c.hit(message, now)
+        self.running += 1
+        return None
+
+    def release(self):
+        self.running -= 1
+
+
+def limit(rate=0, per=0, scope='user', concurrency=0):
+    """
+    Declares a cooldown and/or concurrency cap for a command
+    Can be stacked to combine cooldowns for different scopes
+    """
+    def decorator(func):
+        lim = getattr(func, '__limit__', None)
+        if lim is None:
+            lim = func.__limit__ = Limit()
+        if rate:
+            lim.cooldowns.append(Cooldown(rate, per, scope))
+        if concurrency:
+            lim.concurrency = concurrency
+        return func
+    return decorator
@@ -0,0 +1,66 @@
+import sys
+import atexit
+import queue
+import logging
+import logging.handlers
+import colorlog
+
+logger = logging.getLogger(__package__)
+
+# Set up by configure_logging, so importing turbo doesn't touch the log file
+fh = None
+sh = None
+listener = None
+
+
+def _create_handlers(filename):
+    global fh, sh, listener
+    fh = logging.handlers.RotatingFileHandler(
+        filename=filename, encoding='utf-8', maxBytes=5 * 1024 * 1024, backupCount=3)
+    if fh.stream.tell():
+        # Start every run with a fresh log, keeping the previous ones
+        fh.doRollover()
+    fh.setFormatter(logging.Formatter(
+        "[{asctime}] {levelname} ({filename} L{lineno}, {funcName}): {message}", style='{'
+    ))
+    sh = logging.StreamHandler(stream=sys.stdout)
+    sh.setFormatter(colorlog.LevelFormatter(
+        fmt={
+            "DEBUG": "{log_color}{levelname} ({module} L{lineno}, {funcName}): {message}",
+            "INFO": "{log_color}{message}",
+            "WARNING": "{log_color}{levelname}: {message}",
+            "ERROR": "{log_color}{levelname} ({module} L{lineno}, {funcName}): {message}",
+            "CRITICAL": "{log_color}{levelname} ({module} L{lineno}, {funcName}): {message}"
+        },
+        log_colors={
+            "DEBUG": "purple",
+            "INFO": "white",
+            "WARNING": "yellow",
+            "ERROR": "red",
+            "CRITICAL": "bold_red"
+        },
+        style='{'
+    ))
+
+    # Records are handed to a background thread so that disk and terminal
+    # output never blocks the event loop
+    log_queue = queue.Queue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, fh, sh, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def configure_logging(config, filename='turbo.log'):
+    """
+    Starts logging to the console and to a file, and applies the logging options
+    from the config file. The file is only opened the first time
+    """
+    if listener is None:
+        _create_handlers(filename)
+    fh.setLevel(config.log_filelevel)
+    sh.setLevel(config.log_consolelevel)
+    fh.maxBytes = config.log_maxbytes
+    fh.backupCount = config.log_backups
+    # Records below every handler's level are dropped before being created
+    logger.setLevel(min(fh.level, sh.level))
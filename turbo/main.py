@@ -1,34 +1,80 @@
 import discord
-import inspect
 import asyncio
 import time
 import sys
 import traceback
 import logging
 
-from .utils import Config, Yaml, load_json, dump_json
+from .utils import Config, Yaml, JsonStore
+from .logs import configure_logging
 from .commands import Commands, Response
+from .registry import CommandRegistry
 from .exceptions import InvalidUsage, Shutdown
-from .constants import VERSION, USER_AGENT, BACKUP_TAGS
+from .constants import VERSION, USER_AGENT, BACKUP_TAGS, PENDING_DELETIONS, SHARD_REPORT_INTERVAL
 from .database import Database
 from .req import HTTPClient
+from .index import DiscrimIndex, SnowflakeIndex
+from .stats import Stats
+from .scheduler import DeletionScheduler
+from .outbound import Outbound
+from .permissions import Permissions
+from .metrics import COMMANDS, REJECTED, MetricsServer
+from .profiler import LagMonitor
+from .executor import EXECUTOR
 
 log = logging.getLogger(__name__)
 
 
 class Turbo(discord.Client):
 
-    def __init__(self):
-        self.config = Config('config/turbo.ini')
-
-        super().__init__()
+    def __init__(self, config_file='config/turbo.ini', *, shard_id=None, shard_count=None):
+        self.config = Config(config_file)
+        c = self.config
+        pending = PENDING_DELETIONS
+        log_file = 'turbo.log'
+        if shard_count is not None:
+            log_file = 'turbo-shard{}.log'.format(shard_id)
+        configure_logging(c, log_file)
+        if shard_count is not None:
+            if c.selfbot:
+                log.critical("A selfbot cannot be sharded")
+                raise Shutdown()
+            # Shards share the config, so files and ports are kept apart
+            pending = pending.replace('.json', '_shard{}.json'.format(shard_id))
+            c.metrics_port += shard_id
+            if shard_id:
+                c.backuptags = False
+
+        super().__init__(shard_id=shard_id, shard_count=shard_count)
         self.http.user_agent = USER_AGENT
         self.db = Database(self)
+        self.backup = JsonStore(BACKUP_TAGS, loop=self.loop)
 
-        self.req = HTTPClient(loop=self.loop)
+        self.req = HTTPClient(
+            loop=self.loop, pool_size=c.http_poolsize, per_host=c.http_perhost, keepalive=c.http_keepalive,
+            dns_ttl=c.http_dnsttl, timeout=c.http_timeout, connect_timeout=c.http_connecttimeout,
+            read_timeout=c.http_readtimeout, cache_bytes=c.http_cachebytes, cache_dir=c.http_cachedir)
         self.commands = Commands(self)
-
-        log.info("Turbo ({}). Connecting...".format(VERSION))
+        self.registry = CommandRegistry(self.commands, self.config.prefix)
+        self.discrims = DiscrimIndex()
+        self.snowflakes = SnowflakeIndex(self.messages.maxlen or 0)
+        self.stats = Stats()
+        self.dispatching = 0  # commands currently running
+        self.permissions = Permissions(self)
+        self.outbound = Outbound(loop=self.loop, merge=self.config.mergereplies)
+        self.deletions = DeletionScheduler(self, persist=pending if self.config.persistdeletions else None)
+        self.metrics = MetricsServer(c.metrics_host, c.metrics_port, loop=self.loop) if c.metrics else None
+        self.lag = LagMonitor(self.loop, threshold=c.looplagwarning)
+        EXECUTOR.configure(c.executor, c.executorworkers)
+
+        self._reporting = None
+        self.shutting_down = False  # set once the bot is told to shut down
+        self.login_failed = False
+
+        if shard_count is None:
+            log.info("Turbo ({}). Connecting...".format(VERSION))
+        else:
+            log.info("Turbo ({}). Connecting shard {} of {}...".format(VERSION, shard_id + 1, shard_count))
 
     def run(self, token):
         """
@@ -37,6 +83,7 @@ class Turbo(discord.Client):
         try:
             super().run(token, bot=(not self.config.selfbot))
         except discord.LoginFailure:
+            self.login_failed = True
             log.critical("Incorrect login token")
             if not self.config.selfbot:
                 log.critical(
@@ -47,6 +94,21 @@ class Turbo(discord.Client):
         except discord.HTTPException as e:
             log.critical(e)
 
+    async def close(self):
+        """
+        Overrides discord.py's function for closing the connection
+        """
+        self.db.stop_watching_tags()
+        self.lag.stop()
+        if self._reporting is not None:
+            self._reporting.cancel()
+            self._reporting = None
+        if self.metrics is not None:
+            await self.metrics.stop()
+        await self.req.close()
+        EXECUTOR.shutdown()
+        await super().close()
+
     def format_bool(self, boolean):
         """
         Returns a string based on bool value
@@ -59,9 +121,10 @@ class Turbo(discord.Client):
         """
         return time.time() - self.started
 
-    async def send_message(self, dest, content=None, embed=None, *, tts=False, delete=0):
+    async def send_message(self, dest, content=None, embed=None, *, tts=False, delete=0, merge=True):
         """
         Overrides discord.py's function for sending a message
+        Pass merge=False for messages that will be edited, so no other reply is merged into them
         """
         if content is None and embed is None:
             log.warning('send_message was called but no content was given')
@@ -71,25 +134,25 @@ class Turbo(discord.Client):
             content = None
 
         msg = None
+        send = super().send_message
         try:
             if embed:
-                msg = await super().send_message(dest, embed=embed)
+                msg = await self.outbound.submit('send', dest.id, lambda: send(dest, embed=embed))
             else:
-                msg = await super().send_message(dest, content, tts=tts)
-            log.debug(
-                'Sent message ID {} in #{}'.format(msg.id, dest.name))
+                # Replies with the same deletion delay can be merged when queued together
+                msg = await self.outbound.submit(
+                    'send', dest.id, lambda c: send(dest, c, tts=tts), content=content,
+                    merge=delete if merge and not tts else None)
+            log.debug('Sent message ID %s in #%s', msg.id, dest.name)
 
             if msg and delete and self.config.delete:
-                asyncio.ensure_future(self._delete_after(msg, delete))
+                self.deletions.schedule(msg, delete)
         except discord.Forbidden:
-            log.warning(
-                "No permission to send a message to #{}".format(dest.name))
+            log.warning("No permission to send a message to #%s", dest.name)
         except discord.NotFound:
-            log.warning(
-                "Could not find channel #{} to send a message to".format(dest.name))
+            log.warning("Could not find channel #%s to send a message to", dest.name)
         except discord.HTTPException as e:
-            log.warning(
-                "Problem sending a message in #{}: {}".format(dest.name, e))
+            log.warning("Problem sending a message in #%s: %s", dest.name, e)
         return msg
 
     async def edit_message(self, message, content, *, delete=0):
@@ -97,47 +160,33 @@ class Turbo(discord.Client):
         Overrides discord.py's function for editing a message
         """
         msg = None
+        edit = super().edit_message
         try:
-            msg = await super().edit_message(message, content)
-            log.debug(
-                'Edited message ID {} in #{}'.format(msg.id, msg.channel))
+            msg = await self.outbound.submit('edit', message.channel.id, lambda: edit(message, content))
+            log.debug('Edited message ID %s in #%s', msg.id, msg.channel)
 
             if msg and delete and self.config.delete:
-                asyncio.ensure_future(self._delete_after(msg, delete))
+                self.deletions.schedule(msg, delete)
         except discord.Forbidden:
-            log.warning(
-                "No permission to edit a message in #{}".format(message.channel))
+            log.warning("No permission to edit a message in #%s", message.channel)
         except discord.NotFound:
-            log.warning(
-                "Could not find message ID {} to edit".format(message.id))
+            log.warning("Could not find message ID %s to edit", message.id)
         except discord.HTTPException as e:
-            log.warning(
-                "Problem editing a message in #{}: {}".format(message.channel, e))
+            log.warning("Problem editing a message in #%s: %s", message.channel, e)
         return msg
 
     async def delete_message(self, msg):
         """
         Overrides discord.py's function for deleting a message
         """
+        delete = super().delete_message
         try:
-            await super().delete_message(msg)
-            log.debug(
-                'Deleted message ID {} in #{}'.format(msg.id, msg.channel.name))
+            await self.outbound.submit('delete', msg.channel.id, lambda: delete(msg))
+            log.debug('Deleted message ID %s in #%s', msg.id, msg.channel.name)
         except discord.Forbidden:
-            log.warning(
-                "No permission to delete a message in #{}".format(msg.channel.name))
+            log.warning("No permission to delete a message in #%s", msg.channel.name)
         except discord.HTTPException as e:
-            log.warning(
-                "Problem deleting a message in #{}: {}".format(msg.channel.name, e))
-
-    async def _delete_after(self, msg, time):
-        """
-        Deletes a message after a given amount of time
-        """
-        log.debug(
-            "Scheduled message ID {} to delete ({}s)".format(msg.id, time))
-        await asyncio.sleep(time)
-        await self.delete_message(msg)
+            log.warning("Problem deleting a message in #%s: %s", msg.channel.name, e)
 
     async def on_ready(self):
         """
@@ -146,19 +195,30 @@ class Turbo(discord.Client):
         self.started = time.time()
         log.debug("Bot start time is {}".format(self.started))
         log.info('Logged in as {0} ({0.id})'.format(self.user))
-        print(flush=True)
+        self.discrims.build(self.get_all_members())
+        self.snowflakes.build(self.servers, self.messages)
+        self.stats.build(self.servers)
+        await self.deletions.load()
+        await self.permissions.get_owner()
+        self.lag.start()
+        if self.metrics is not None:
+            try:
+                await self.metrics.start()
+            except OSError as e:
+                log.error("Could not serve metrics: %s", e)
+        log.info('')
         log.info('General:')
         log.info('- Prefix: ' + self.config.prefix)
         log.info('- Selfbot: ' + self.format_bool(self.config.selfbot))
         log.info('- Private Messages: ' + self.format_bool(self.config.pm))
         log.info('- Delete Messages: ' + self.format_bool(self.config.delete))
-        print(flush=True)
+        log.info('')
         log.info('Advanced:')
         log.info('- No Database: ' + self.format_bool(self.config.nodatabase))
         log.info('- Read Aliases: ' + self.format_bool(self.config.readaliases))
         log.info('- Selfbot Message Editing: ' + self.format_bool(self.config.selfbotmessageedit))
         log.info('- Discrim Name Revert: ' + self.format_bool(self.config.discrimrevert))
-        print(flush=True)
+        log.info('')
         log.info('Database:')
         log.info('- Server: {0.rhost}:{0.rport} ({0.ruser})'.format(self.config))
 
@@ -169,16 +229,12 @@ class Turbo(discord.Client):
             if connect:
                 # Create needed tables
                 await self.db.create_table(self.config.dbtable_tags, primary='name')
-                if self.config.backuptags:
-                    # Dump any existing tags to backup file
-                    log.info("Backing up existing tags to JSON file...")
-                    cursor = await self.db.get_db().table(self.config.dbtable_tags).run(self.db.db)
-                    current_backup = load_json(BACKUP_TAGS)
-                    for i in cursor.items:
-                        name = i['name']
-                        current_backup[name] = i['content']
-                    dump_json(BACKUP_TAGS, current_backup)
-                    log.info("Tags have been backed up to {} in case of a database outage".format(BACKUP_TAGS))
+                if self.shard_count is not None:
+                    await self.db.create_table(self.config.dbtable_shards)
+                    if self._reporting is None:
+                        self._reporting = asyncio.ensure_future(self.report_shard())
+                if self.config.livetags:
+                    self.db.watch_tags()
             else:
                 log.warning("A database connection could not be established")
                 self.dbfailed = True
@@ -189,7 +245,7 @@ class Turbo(discord.Client):
             log.warning(
                 "As the database is unavailable, tags cannot be created or deleted, but tags that exist in the backup JSON file can be triggered.")
         self.db.ready = True
-        print(flush=True)
+        log.info('')
 
         # Yaml checks
         log.info('Aliases:')
@@ -198,30 +254,51 @@ class Turbo(discord.Client):
             if self.aliases is None:
                 log.warning("No command aliases will be available. See 'readme.md' for information")
             else:
-                for c in self.aliases.copy():
-                    h = getattr(self.commands, 'c_%s' % c, None)
-                    if not h:
-                        log.warning("{} is not a command".format(c))
-                        del self.aliases[c]
-                headings = [c for c in self.aliases]
-                aliases = []
-                for i in headings:
-                    aliases += [a for a in self.aliases[i]]
-                log.info("- Found {} aliases".format(len(aliases)))
-                dupes = set([x for x in aliases if aliases.count(x) > 1])
-                if dupes:
-                    # there are duplicate aliases
-                    for i in dupes:
-                        log.warning("{} is an alias used by multiple commands. Check the aliases file".format(i))
+                unknown, dupes = self.registry.load_aliases(self.aliases)
+                for c in unknown:
+                    log.warning("{} is not a command".format(c))
+                    del self.aliases[c]
+                log.info("- Found {} aliases".format(len(self.registry.aliases)))
+                for i in dupes:
+                    log.warning("{} is an alias used by multiple commands. Check the aliases file".format(i))
         else:
             self.aliases = None
             log.warning("Skipped aliases checking per configuration file")
 
-        print(flush=True)
+        log.info('')
         log.info('Bot is ready!')
-        print(flush=True)
+        log.info('')
+
+        if not self.dbfailed and self.config.backuptags:
+            asyncio.ensure_future(self.backup_tags())
+
+    async def report_shard(self):
+        """
+        Saves this shard's stats to the database so any shard can show the totals
+        """
+        while True:
+            data = dict(self.stats.snapshot(), id=self.shard_id, shard_count=self.shard_count,
+                        commands=self.stats.commands, updated=time.time())
+            try:
+                await self.db.insert(self.config.dbtable_shards, data)
+            except Exception as e:
+                log.warning("Could not report shard stats: %s", e)
+            await asyncio.sleep(SHARD_REPORT_INTERVAL)
+
+    async def backup_tags(self):
+        """
+        Dumps any existing tags to the backup file in case of a database outage
+        """
+        log.info("Backing up existing tags to JSON file...")
+        try:
+            count = await self.db.backup_tags(self.backup)
+        except Exception as e:
+            log.error("Problem backing up tags: {}".format(e))
+        else:
+            log.info("{} tags have been backed up to {} in case of a database outage".format(count, BACKUP_TAGS))
 
     async def on_message(self, message):
+        self.snowflakes.add_message(message)
         await self.wait_until_ready()
         if not self.db.ready:
             return
@@ -235,93 +312,147 @@ class Turbo(discord.Client):
         cmd, *args = content.split()
         cmd = cmd[len(self.config.prefix):].lower().strip()
 
-        h = getattr(self.commands, 'c_%s' % cmd, None)
-
-        if not h:
-            # Check aliases
-            # This is a relatively expensive loop but should be okay
-            # as it is only called after a command prefix is found
-            if self.aliases is not None:
-                for i in self.aliases:
-                    for i2 in self.aliases[i]:
-                        if cmd == i2:
-                            log.debug("Detected alias {} -> {}".format(cmd, i))
-                            cmd = i
-                            h = getattr(self.commands, 'c_%s' % cmd, None)
-                            if not h:  # theoretically this should never be a true statement
-                                return
-            else:
-                return
+        command = self.registry.get(cmd)
+
+        if not command:
+            return
+        cmd = command.name
 
         if not message.channel.is_private:
-            log.info(
-                "[Command] {0} [{1.server} | #{1}] - {2}".format(message.author, message.channel, content))
+            log.info("[Command] %s [%s | #%s] - %s", message.author, message.server, message.channel, content)
         else:
-            log.info(
-                "[Command] {0} [Private Message | {1}] - {2}".format(message.author, message.channel, content))
-
-        s = inspect.signature(h)
-        p = s.parameters.copy()
-        kw = {}
-        if p.pop('message', None):
-            kw['message'] = message
-        if p.pop('channel', None):
-            kw['channel'] = message.channel
-        if p.pop('author', None):
-            kw['author'] = message.author
-        if p.pop('server', None):
-            kw['server'] = message.server
-        if p.pop('args', None):
-            kw['args'] = args
-
-        ae = []
-        for key, param in list(p.items()):
-            doc_key = '[%s=%s]' % (
-                key, param.default) if param.default is not inspect.Parameter.empty else key
-            ae.append(doc_key)
-            if not args and param.default is not inspect.Parameter.empty:
-                p.pop(key)
-                continue
-            if args:
-                v = args.pop(0)
-                kw[key] = v
-                p.pop(key)
-
+            log.info("[Command] %s [Private Message | %s] - %s", message.author, message.channel, content)
+
+        if command.checks:
+            denial = await self.permissions.evaluate(command.checks, message)
+            if denial is not None:
+                log.debug("Denied command %s used by %s", cmd, message.author)
+                REJECTED.labels(cmd, 'denied').inc()
+                return await self.respond(message, self.format_response(message, Response(denial)), delete=10)
+
+        if self.dispatching >= self.config.maxcommands:
+            log.warning("Rejected command %s, %s commands are already running", cmd, self.dispatching)
+            REJECTED.labels(cmd, 'busy').inc()
+            return await self.respond(message, ":warning: The bot is busy, try again shortly", delete=5)
+        limit = command.limit
+        if limit is not None:
+            reason = limit.acquire(message)
+            if reason is not None:
+                log.debug("Limited command %s used by %s", cmd, message.author)
+                REJECTED.labels(cmd, 'limited').inc()
+                return await self.respond(message, ":hourglass: `{}` {}".format(cmd, reason), delete=5)
+
+        self.dispatching += 1
+        start = time.perf_counter()
+        outcome = 'exception'
         try:
-            if p:
-                raise InvalidUsage()
-
-            r = await h(**kw)
+            kw = command.bind(message, args)
+            r = await command.handler(**kw)
+            outcome = 'ok'
             if r and isinstance(r, Response):
-                content = r.content
-                if r.reply and not self.config.selfbot:
-                    content = "{}: {}".format(message.author.mention, content)
-                if self.config.selfbot and self.config.selfbotmessageedit:
-                    return await self.edit_message(message, content, delete=r.delete)
-                else:
-                    return await self.send_message(message.channel, content, delete=r.delete)
+                return await self.respond(message, self.format_response(message, r), delete=r.delete)
         except InvalidUsage:
-            log.debug("Invalid usage for command {} used by {}".format(cmd, message.author))
-            docs = getattr(h, '__doc__', None)
-            docs = '\n'.join(l.strip() for l in docs.split('\n'))
-            docs = ":warning: Incorrect usage.\n```\n{}\n```".format(
-                docs.format(prefix=self.config.prefix))
-            if self.config.selfbot and self.config.selfbotmessageedit:
-                return await self.edit_message(message, docs, delete=10)
-            return await self.send_message(message.channel, docs, delete=10)
+            outcome = 'invalid'
+            log.debug("Invalid usage for command %s used by %s", cmd, message.author)
+            return await self.respond(message, command.usage, delete=10)
         except Shutdown:
+            outcome = 'ok'
             raise
         except Exception as e:
+            if isinstance(e, discord.Forbidden):
+                outcome = 'forbidden'
             e = ":warning: An exception occurred: `{}`. For more information, see the console.".format(e)
-            if self.config.selfbot and self.config.selfbotmessageedit:
-                return await self.edit_message(message, e, delete=10)
-            return await self.send_message(message.channel, e, delete=10)
+            return await self.respond(message, e, delete=10)
             raise
+        finally:
+            self.dispatching -= 1
+            if limit is not None:
+                limit.release()
+            elapsed = time.perf_counter() - start
+            self.stats.record_command(elapsed)
+            COMMANDS.labels(cmd, outcome).observe(elapsed)
+
+    def format_response(self, message, r):
+        """
+        Returns the content to send for a command's Response
+        """
+        if r.reply and not self.config.selfbot:
+            return "{}: {}".format(message.author.mention, r.content)
+        return r.content
+
+    async def respond(self, message, content, *, delete=0, merge=True):
+        """
+        Responds to a command message
+        Edits the message instead when the selfbot is configured to
+        """
+        if self.config.selfbot and self.config.selfbotmessageedit:
+            return await self.edit_message(message, content, delete=delete)
+        return await self.send_message(message.channel, content, delete=delete, merge=merge)
+
+    async def on_message_delete(self, message):
+        self.snowflakes.remove_message(message)
+
+    async def on_member_join(self, member):
+        self.discrims.add(member)
+        self.snowflakes.add_member(member)
+        self.stats.add_member(member)
+
+    async def on_member_remove(self, member):
+        self.discrims.remove(member)
+        self.snowflakes.remove_member(member)
+        self.stats.remove_member(member)
+
+    async def on_member_update(self, before, after):
+        self.discrims.update(before, after)
+        self.snowflakes.add('user', after)
+        self.stats.update_member(before, after)
+
+    async def on_server_join(self, server):
+        self.discrims.add_server(server)
+        self.snowflakes.add_server(server)
+        self.stats.add_server(server)
+
+    async def on_server_remove(self, server):
+        self.discrims.remove_server(server)
+        self.snowflakes.remove_server(server)
+        self.stats.remove_server(server)
+
+    async def on_server_update(self, before, after):
+        self.snowflakes.add('server', after)
+        self.stats.update_server(after)
+
+    async def on_channel_create(self, channel):
+        if not channel.is_private:
+            self.snowflakes.add('channel', channel)
+
+    async def on_channel_delete(self, channel):
+        if not channel.is_private:
+            self.snowflakes.remove('channel', channel)
+
+    async def on_channel_update(self, before, after):
+        if not after.is_private:
+            self.snowflakes.add('channel', after)
+
+    async def on_server_role_create(self, role):
+        self.snowflakes.add('role', role)
+
+    async def on_server_role_delete(self, role):
+        self.snowflakes.remove('role', role)
+
+    async def on_server_role_update(self, before, after):
+        self.snowflakes.add('role', after)
+
+    async def on_server_emojis_update(self, before, after):
+        self.snowflakes.update_emojis(before, after)
+        emojis = after or before
+        if emojis:
+            self.stats.update_server(emojis[0].server)
 
     async def on_error(self, event, *args, **kwargs):
         et, e, es = sys.exc_info()
         if et == Shutdown:
             log.debug("Shutdown signal received. Terminating...")
+            self.shutting_down = True
             await self.logout()
         else:
             traceback.print_exc()
@@ -0,0 +1,248 @@
+import asyncio
+import bisect
+import logging
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the default histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(names, values, extra=''):
+    pairs = ['{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class CounterValue:
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class HistogramValue:
+
+    """
+    Counts of observations in fixed buckets
+    Recording only updates numbers that already exist, samples are not kept
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+
+    """
+    A named metric with one value for each combination of label values
+    """
+
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._values = {}  # tuple of label values -> value
+
+    def labels(self, *values):
+        """
+        Returns the value for the given label values, creating it the first time
+        Hot paths can keep the returned value to skip the lookup
+        """
+        value = self._values.get(values)
+        if value is None:
+            if len(values) != len(self.label_names):
+                raise ValueError("{} takes labels {}".format(self.name, self.label_names))
+            value = self._values[values] = self._new()
+        return value
+
+    def _new(self):
+        raise NotImplementedError
+
+    def expose(self):
+        yield "# HELP {} {}".format(self.name, self.doc)
+        yield "# TYPE {} {}".format(self.name, self.kind)
+        for values, value in sorted(self._values.items()):
+            yield from self._expose(values, value)
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def _new(self):
+        return CounterValue()
+
+    def _expose(self, values, value):
+        yield "{}{} {}".format(self.name, format_labels(self.label_names, values), value.value)
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self):
+        return HistogramValue(self.buckets)
+
+    def _expose(self, values, value):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), value.counts):
+            total += count
+            le = 'le="{}"'.format(bound)
+            yield "{}_bucket{} {}".format(self.name, format_labels(self.label_names, values, le), total)
+        labels = format_labels(self.label_names, values)
+        yield "{}_sum{} {}".format(self.name, labels, value.sum)
+        yield "{}_count{} {}".format(self.name, labels, value.count)
+
+
+class Registry:
+
+    """
+    Every metric the bot records, exposed together in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("{} is already a metric".format(metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, doc, labels=()):
+        return self._add(Counter(name, doc, labels))
+
+    def histogram(self, name, doc, labels=(), buckets=BUCKETS):
+        return self._add(Histogram(name, doc, labels, buckets))
+
+    def expose(self):
+        """
+        Returns every metric in the text exposition format
+        """
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].expose())
+        lines.append('')
+        return '\n'.join(lines)
+
+
+REGISTRY = Registry()
+
+COMMANDS = REGISTRY.histogram(
+    'turbo_command_seconds', "Time taken to dispatch commands", ('command', 'outcome'))
+REJECTED = REGISTRY.counter(
+    'turbo_commands_rejected_total', "Commands that were not run", ('command', 'reason'))
+QUERIES = REGISTRY.histogram(
+    'turbo_database_seconds', "Time taken by database queries", ('operation', 'outcome'))
+HTTP = REGISTRY.histogram(
+    'turbo_http_seconds', "Time taken by web requests made by commands", ('method', 'outcome'))
+OUTBOUND = REGISTRY.histogram(
+    'turbo_outbound_seconds', "Time taken by requests sent to Discord", ('kind', 'outcome'))
+OUTBOUND_WAIT = REGISTRY.histogram(
+    'turbo_outbound_wait_seconds', "Time requests to Discord waited in their queue", ('kind',))
+
+
+class WebServer:
+
+    """
+    Serves an aiohttp application with whichever server API the installed
+    aiohttp version has
+    """
+
+    def __init__(self, app, *, loop=None):
+        self.app = app
+        self.loop = loop or asyncio.get_event_loop()
+        self.port = None
+        self._runner = None
+        self._server = None
+        self._handler = None
+
+    async def start(self, host, port=0):
+        """
+        Starts serving, a port of 0 uses any free one
+        Returns the port served on
+        """
+        if hasattr(web, 'AppRunner'):
+            self._runner = web.AppRunner(self.app)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, host, port)
+            await site.start()
+            sockets = site._server.sockets
+        else:
+            # Older aiohttp versions only have the low level server
+            self._handler = self.app.make_handler()
+            self._server = await self.loop.create_server(self._handler, host, port)
+            sockets = self._server.sockets
+        self.port = sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            await self.app.shutdown()
+            await self._handler.finish_connections(1.0)
+            await self.app.cleanup()
+            self._server = None
+
+
+class MetricsServer:
+
+    """
+    Serves the registry over HTTP for Prometheus to scrape
+    """
+
+    def __init__(self, host, port, *, registry=REGISTRY, loop=None):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.loop = loop
+        self._server = None
+
+    async def handle(self, request):
+        return web.Response(text=self.registry.expose(), content_type='text/plain')
+
+    async def start(self):
+        """
+        Starts serving, unless already started
+        """
+        if self._server is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._server = WebServer(app, loop=self.loop)
+        await self._server.start(self.host, self.port)
+        log.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            await self._server.stop()
+            self._server = None
@@ -0,0 +1,239 @@
+import asyncio
+import collections
+import logging
+import time
+
+import discord
+
+from .metrics import OUTBOUND, OUTBOUND_WAIT
+
+log = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 2000  # most characters Discord allows in a message
+
+# Requests allowed per period (in seconds) for each kind of route, per channel
+LIMITS = {
+    'send': (5, 5.0),
+    'edit': (5, 5.0),
+    'delete': (5, 1.0),
+    'bulk_delete': (1, 1.0),
+}
+
+
+class Bucket:
+
+    """
+    Local view of a Discord rate limit bucket
+    """
+
+    __slots__ = ('limit', 'per', 'remaining', 'reset')
+
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset = 0.0
+
+    def delay(self):
+        """
+        Returns how many seconds to wait before the next request
+        """
+        now = time.monotonic()
+        if now >= self.reset:
+            self.remaining = self.limit
+            self.reset = now + self.per
+        if self.remaining > 0:
+            return 0.0
+        return self.reset - now
+
+    def consume(self):
+        self.remaining -= 1
+
+    def update(self, headers):
+        """
+        Updates the bucket from rate limit response headers
+        """
+        try:
+            if 'X-RateLimit-Limit' in headers:
+                self.limit = int(headers['X-RateLimit-Limit'])
+            if 'X-RateLimit-Remaining' in headers:
+                self.remaining = int(headers['X-RateLimit-Remaining'])
+            if 'X-RateLimit-Reset' in headers:
+                # Reset is a unix timestamp
+                self.reset = time.monotonic() + max(float(headers['X-RateLimit-Reset']) - time.time(), 0)
+            if 'Retry-After' in headers:
+                # Milliseconds in the Discord API version used by discord.py
+                self.remaining = 0
+                self.reset = time.monotonic() + float(headers['Retry-After']) / 1000
+        except ValueError:
+            pass
+
+
+class Job:
+
+    __slots__ = ('func', 'content', 'merge', 'futures', 'queued')
+
+    def __init__(self, func, content, merge, future):
+        self.func = func
+        self.content = content
+        self.merge = merge
+        self.futures = [future]
+        self.queued = time.monotonic()
+
+
+class Route:
+
+    """
+    Queue of pending requests for one route, paced by its bucket
+    """
+
+    def __init__(self, key):
+        self.key = key
+        kind = key[0]
+        self.bucket = Bucket(*LIMITS.get(kind, LIMITS['send']))
+        self.jobs = collections.deque()
+        self.worker = None
+
+
+class Outbound:
+
+    """
+    Sends outgoing requests through one queue per channel and kind of request
+    Requests are paced to stay inside rate limits, and short replies waiting
+    in the same queue can be merged into one message
+    """
+
+    def __init__(self, *, loop=None, merge=True, max_idle=1000):
+        self.loop = loop or asyncio.get_event_loop()
+        self.merge = merge
+        self.max_idle = max_idle
+        self.routes = {}  # (kind, channel id) -> Route, kept while their bucket matters
+
+        self.requests = 0
+        self.merged = 0
+        self.paced = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def depth(self):
+        """
+        Returns the amount of requests waiting in every queue
+        """
+        return sum(len(r.jobs) for r in self.routes.values() if r.worker is not None)
+
+    def stats(self):
+        """
+        Returns the queue counters as a dict
+        """
+        return {
+            'routes': len(self.routes),
+            'depth': self.depth(),
+            'requests': self.requests,
+            'merged': self.merged,
+            'paced': self.paced,
+            'wait_avg': (self.wait_total / self.requests) if self.requests else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+    def submit(self, kind, channel_id, func, *, content=None, merge=None):
+        """
+        Queues a request and returns a future for its result
+
+        func is called with no arguments, or with the content if it is given
+        Requests with content and an equal merge key can be merged together
+        """
+        key = (kind, channel_id)
+        route = self.routes.get(key)
+        if route is None:
+            if len(self.routes) >= self.max_idle:
+                self._prune()
+            route = self.routes[key] = Route(key)
+        future = self.loop.create_future()
+        if not self.merge:
+            merge = None
+        route.jobs.append(Job(func, content, merge, future))
+        if route.worker is None:
+            route.worker = asyncio.ensure_future(self._work(route), loop=self.loop)
+        return future
+
+    def _prune(self):
+        """
+        Forgets idle routes whose buckets have reset
+        """
+        now = time.monotonic()
+        for key, route in list(self.routes.items()):
+            if route.worker is None and route.bucket.reset <= now:
+                del self.routes[key]
+
+    def _take(self, route):
+        """
+        Takes the next job, merging any mergeable jobs queued behind it
+        """
+        job = route.jobs.popleft()
+        if job.merge is None or job.content is None:
+            return job
+        while route.jobs:
+            nxt = route.jobs[0]
+            if nxt.merge != job.merge or nxt.content is None:
+                break
+            content = job.content + '\n' + nxt.content
+            if len(content) > MESSAGE_LIMIT:
+                break
+            route.jobs.popleft()
+            job.content = content
+            job.futures.extend(nxt.futures)
+            self.merged += 1
+        return job
+
+    async def _work(self, route):
+        kind = route.key[0]
+        wait_metric = OUTBOUND_WAIT.labels(kind)
+        try:
+            while route.jobs:
+                delay = route.bucket.delay()
+                if delay > 0:
+                    self.paced += 1
+                    await asyncio.sleep(delay)
+                    continue
+                job = self._take(route)
+                start = time.monotonic()
+                waited = start - job.queued
+                self.requests += 1
+                self.wait_total += waited
+                if waited > self.wait_max:
+                    self.wait_max = waited
+                wait_metric.observe(waited)
+
+                route.bucket.consume()
+                try:
+                    if job.content is not None:
+                        result = await job.func(job.content)
+                    else:
+                        result = await job.func()
+                except discord.HTTPException as e:
+                    outcome = 'forbidden' if isinstance(e, discord.Forbidden) else 'error'
+                    response = getattr(e, 'response', None)
+                    if response is not None:
+                        route.bucket.update(response.headers)
+                    for f in job.futures:
+                        if not f.done():
+                            f.set_exception(e)
+                except Exception as e:
+                    outcome = 'exception'
+                    for f in job.futures:
+                        if not f.done():
+                            f.set_exception(e)
+                else:
+                    outcome = 'ok'
+                    for f in job.futures:
+                        if not f.done():
+                            f.set_result(result)
+                OUTBOUND.labels(kind, outcome).observe(time.monotonic() - start)
+        finally:
+            route.worker = None
+            if route.jobs:
+                # Cancelled with jobs still waiting
+                for job in route.jobs:
+                    for f in job.futures:
+                        f.cancel()
+                route.jobs.clear()
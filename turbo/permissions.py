@@ -0,0 +1,71 @@
+import time
+import logging
+
+import discord
+
+log = logging.getLogger(__name__)
+
+
+def require(func, check, denial):
+    """
+    Declares a check that must pass before a command runs
+    denial is the response given when it does not
+    """
+    func.__checks__ = getattr(func, '__checks__', ()) + ((check, denial),)
+    return func
+
+
+class Permissions:
+
+    """
+    Resolves the checks declared on commands for a message
+    The application owner is looked up once and cached
+    """
+
+    def __init__(self, bot, *, refresh=3600):
+        self.bot = bot
+        self.refresh = refresh
+        self.owner_id = None
+        self._resolved = 0
+
+    async def resolve_owner(self):
+        """
+        Looks up the ID of the user that owns the bot application
+        """
+        if self.bot.user.bot:
+            self.owner_id = (await self.bot.application_info()).owner.id
+        else:
+            self.owner_id = self.bot.user.id
+        self._resolved = time.monotonic()
+        log.debug("Application owner is %s", self.owner_id)
+
+    async def get_owner(self):
+        """
+        Returns the cached owner ID, resolving it again if it is stale or missing
+        """
+        if self.owner_id is None or time.monotonic() - self._resolved > self.refresh:
+            try:
+                await self.resolve_owner()
+            except discord.HTTPException as e:
+                # Keep using the previous owner and try again next time
+                log.warning("Could not get the application owner: %s", e)
+        return self.owner_id
+
+    async def passes(self, check, message):
+        if check == 'selfbot':
+            return self.bot.config.selfbot
+        if check == 'db':
+            return self.bot.db.db is not None
+        if check == 'creator':
+            owner = await self.get_owner()
+            return owner is not None and message.author.id == owner
+        raise ValueError("{} is not a permission check".format(check))
+
+    async def evaluate(self, checks, message):
+        """
+        Returns the denial of the first check that fails, or None if all pass
+        """
+        for check, denial in checks:
+            if not await self.passes(check, message):
+                return denial
+        return None
@@ -0,0 +1,147 @@
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+from .metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.histogram(
+    'turbo_loop_lag_seconds', "How late the event loop ran a scheduled callback").labels()
+STALLS = REGISTRY.counter(
+    'turbo_loop_stalls_total', "Times the event loop was blocked past the warning threshold", ('command',))
+
+
+def describe(frame):
+    """Returns where a frame is as file:line in function"""
+    code = frame.f_code
+    return "{}:{} in {}".format(os.path.basename(code.co_filename), frame.f_lineno, code.co_name)
+
+
+def running_command(frame):
+    """
+    Returns the name of the command handler in a stack, or None
+    """
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name.startswith('c_') and os.path.basename(code.co_filename) == 'commands.py':
+            return code.co_name[2:]
+        frame = frame.f_back
+    return None
+
+
+def collapse(frame, root):
+    """
+    Returns a stack as root;outermost;...;innermost, the collapsed format used by
+    flamegraph.pl and speedscope
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    names.append(root)
+    return ';'.join(reversed(names))
+
+
+def sample(duration, interval=0.005):
+    """
+    Samples the stack of every other thread for duration seconds
+    Returns a Counter of collapsed stacks
+    """
+    counts = collections.Counter()
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                counts[collapse(frame, names.get(ident, str(ident)))] += 1
+        time.sleep(interval)
+    return counts
+
+
+class LagMonitor:
+
+    """
+    Measures how late the event loop runs a timer, and works out what blocked it
+    A watchdog thread looks at the loop's stack while it is blocked, so slow
+    callbacks can be blamed on the command that was running
+    """
+
+    def __init__(self, loop, *, interval=0.5, threshold=0.25):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+
+        self.stalls = 0
+        self.worst = 0.0
+        self.worst_where = None
+
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._loop_thread = None
+        self._beat = 0.0
+        self._culprit = None  # (command, where) seen by the watchdog
+
+    def start(self):
+        """
+        Starts monitoring, must be called from the event loop's thread
+        """
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop = threading.Event()
+        self._task = asyncio.ensure_future(self._tick(), loop=self.loop)
+        if self.threshold:
+            self._thread = threading.Thread(
+                target=self._watch, args=(self._stop,), name='turbo-watchdog', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stop.set()
+        self._thread = None
+
+    async def _tick(self):
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(self.loop.time() - start - self.interval, 0)
+            self._beat = time.monotonic()
+            LOOP_LAG.observe(lag)
+            if self.threshold and lag >= self.threshold:
+                self._report(lag)
+
+    def _report(self, lag):
+        culprit, self._culprit = self._culprit, None
+        command, where = culprit or (None, None)
+        self.stalls += 1
+        if lag > self.worst:
+            self.worst = lag
+            self.worst_where = command or where
+        STALLS.labels(command or '').inc()
+        if command:
+            log.warning("Event loop was blocked for %.2fs by command %s (%s)", lag, command, where)
+        else:
+            log.warning("Event loop was blocked for %.2fs (%s)", lag, where or "no stack was seen")
+
+    def _watch(self, stop):
+        # Runs in its own thread so it can look at the loop while it is blocked
+        checked = None
+        while not stop.wait(self.threshold / 2):
+            beat = self._beat
+            if beat == checked or time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._culprit = (running_command(frame), describe(frame))
+            checked = beat
@@ -0,0 +1,130 @@
+import inspect
+import logging
+
+from operator import attrgetter
+
+from .exceptions import InvalidUsage
+
+log = logging.getLogger(__name__)
+
+# Context objects that can be injected into a command by parameter name
+INJECTABLE = {
+    'message': lambda m: m,
+    'channel': attrgetter('channel'),
+    'author': attrgetter('author'),
+    'server': attrgetter('server'),
+}
+
+
+class Command:
+
+    """
+    Precomputed invocation plan for a command handler
+    """
+
+    __slots__ = ('name', 'handler', 'aliases', 'checks', 'limit', 'inject', 'params', 'required', 'wants_args', 'doc', 'usage')
+
+    def __init__(self, name, handler, prefix):
+        self.name = name
+        self.handler = handler
+        self.aliases = []
+        self.checks = getattr(handler, '__checks__', ())
+        self.limit = getattr(handler, '__limit__', None)
+
+        inject = []
+        params = []
+        required = 0
+        self.wants_args = False
+        for key, param in inspect.signature(handler).parameters.items():
+            if key in INJECTABLE:
+                inject.append((key, INJECTABLE[key]))
+            elif key == 'args':
+                self.wants_args = True
+            else:
+                params.append(key)
+                if param.default is inspect.Parameter.empty:
+                    required += 1
+        self.inject = tuple(inject)
+        self.params = tuple(params)
+        self.required = required
+
+        docs = getattr(handler, '__doc__', None) or ''
+        docs = '\n'.join(l.strip() for l in docs.split('\n'))
+        self.doc = docs.format(prefix=prefix)
+        self.usage = ":warning: Incorrect usage.\n```\n{}\n```".format(self.doc)
+
+    def bind(self, message, args):
+        """
+        Builds the keyword arguments for a call to the handler
+
+        Raises InvalidUsage if required arguments are missing
+        """
+        n = len(self.params)
+        if len(args) < self.required:
+            raise InvalidUsage()
+        kw = dict(zip(self.params, args))
+        for key, getter in self.inject:
+            kw[key] = getter(message)
+        if self.wants_args:
+            kw['args'] = args[n:]
+        return kw
+
+
+class CommandRegistry:
+
+    """
+    Maps command names to their invocation plans
+    Built once when the bot starts so dispatching is a dict lookup
+    """
+
+    def __init__(self, commands, prefix):
+        self.commands = {}
+        self.aliases = {}
+        for attr in dir(commands):
+            if attr.startswith('c_'):
+                name = attr[2:].lower()
+                self.commands[name] = Command(name, getattr(commands, attr), prefix)
+        log.debug("Registered %d commands", len(self.commands))
+
+    def load_aliases(self, aliases):
+        """
+        Builds the alias -> command index from the parsed aliases file
+
+        Returns a tuple of (unknown commands, duplicate aliases)
+        """
+        self.aliases = {}
+        for command in self.commands.values():
+            command.aliases = []
+        unknown = []
+        dupes = set()
+        for name, names in aliases.items():
+            command = self.commands.get(name)
+            if command is None:
+                unknown.append(name)
+                continue
+            for alias in names or ():
+                alias = str(alias).lower()
+                if alias in self.aliases or alias in self.commands:
+                    dupes.add(alias)
+                    continue
+                self.aliases[alias] = command
+                command.aliases.append(alias)
+        return unknown, dupes
+
+    def get(self, name):
+        """
+        Returns the command for a name or alias, or None
+        """
+        command = self.commands.get(name)
+        if command is None:
+            command = self.aliases.get(name)
+        return command
+
+    def __contains__(self, name):
+        return name in self.commands
+
+    def __iter__(self):
+        return iter(self.commands.values())
+
+    def __len__(self):
+        return len(self.commands)
@@ -1,11 +1,202 @@
 import aiohttp
 import asyncio
+import hashlib
+import inspect
+import json as jsonlib
 import logging
+import os
+import time
 
+from .cache import LRUCache
 from .constants import USER_AGENT
+from .metrics import HTTP
 
 log = logging.getLogger(__name__)
 
+# Request headers that can change a response, used to tell identical requests apart
+VARY_HEADERS = ('accept', 'accept-encoding', 'accept-language', 'authorization', 'cookie')
+
+
+def accepts(cls, option):
+    """
+    Returns whether an aiohttp class takes an option, which varies between versions
+    """
+    return option in inspect.signature(cls).parameters
+
+
+def supported(cls, options):
+    """
+    Returns the options an aiohttp class takes, dropping the others
+    """
+    return dict((k, v) for k, v in options.items() if accepts(cls, k))
+
+
+def content_type(headers):
+    """
+    Returns the media type of a response without its parameters
+    """
+    return headers.get('Content-Type', '').partition(';')[0].strip().lower()
+
+
+class CachedResponse:
+
+    """
+    A response body along with what is needed to revalidate it
+    """
+
+    __slots__ = ('url', 'content_type', 'body', 'etag', 'last_modified', 'expires', 'key')
+
+    def __init__(self, url, content_type, body, etag=None, last_modified=None, expires=0, key=None):
+        self.url = url
+        self.key = key or url  # the URL and any headers that change the response
+        self.content_type = content_type
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires  # wall clock time the response is fresh until
+
+    def fresh(self):
+        return self.expires > time.time()
+
+    def conditional_headers(self):
+        """
+        Returns the headers needed to revalidate the response
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def update(self, headers):
+        """
+        Refreshes validators and freshness from a response's headers
+        """
+        self.etag = headers.get('ETag', self.etag)
+        self.last_modified = headers.get('Last-Modified', self.last_modified)
+        self.expires = freshness(headers)
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def cache_key(url, headers):
+    """
+    Returns the key of a GET request in the response cache
+    Requests that only differ in headers that do not change the response share a key
+    """
+    vary = sorted((k.lower(), v) for k, v in headers.items() if k.lower() in VARY_HEADERS)
+    if not vary:
+        return url
+    return '\n'.join([url] + ['{}: {}'.format(k, v) for k, v in vary])
+
+
+def cache_control(headers):
+    """
+    Parses a Cache-Control header into a dict of directive -> value
+    """
+    directives = {}
+    for part in headers.get('Cache-Control', '').split(','):
+        key, _, value = part.strip().partition('=')
+        if key:
+            directives[key.lower()] = value.strip('"')
+    return directives
+
+
+def freshness(headers):
+    """
+    Returns the wall clock time a response is fresh until
+    """
+    cc = cache_control(headers)
+    if 'no-cache' in cc or 'no-store' in cc:
+        return 0
+    try:
+        return time.time() + int(cc.get('max-age', 0))
+    except ValueError:
+        return 0
+
+
+class ResponseCache:
+
+    """
+    In-memory LRU of GET responses bounded in bytes
+    Evicted responses can optionally spill over to a directory on disk
+    """
+
+    def __init__(self, max_bytes, *, directory=None, disk_entries=1000, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.memory = LRUCache(max_entries=float('inf'), max_bytes=max_bytes,
+                               sizeof=lambda k, v: len(v.body), on_evict=self._spill)
+        self.directory = directory or None
+        self.disk_entries = disk_entries
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def stats(self):
+        """
+        Returns the cache counters as a dict
+        """
+        total = self.hits + self.revalidated + self.misses
+        return {
+            'entries': len(self.memory),
+            'bytes': self.memory.size,
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'ratio': ((self.hits + self.revalidated) / total) if total else 0.0,
+            'bytes_saved': self.bytes_saved,
+        }
+
+    async def get(self, key):
+        """
+        Returns the cached response for a key from cache_key, or None
+        """
+        entry = self.memory.get(key)
+        if entry is None and self.directory:
+            entry = await self.loop.run_in_executor(None, self._read, key)
+            if entry is not None:
+                self.memory.put(key, entry)
+        return entry
+
+    def put(self, entry):
+        self.memory.put(entry.key, entry)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def _spill(self, key, entry):
+        if self.directory:
+            self.loop.run_in_executor(None, self._write, entry)
+
+    def _read(self, key):
+        try:
+            with open(self._path(key)) as f:
+                data = jsonlib.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('key') != key:
+            return None
+        return CachedResponse(**data)
+
+    def _write(self, entry):
+        try:
+            with open(self._path(entry.key), 'w') as f:
+                jsonlib.dump(entry.to_dict(), f)
+            files = [os.path.join(self.directory, f) for f in os.listdir(self.directory)]
+            if len(files) > self.disk_entries:
+                # Remove the oldest half
+                files.sort(key=os.path.getmtime)
+                for f in files[:len(files) // 2]:
+                    os.remove(f)
+        except OSError as e:
+            log.warning("Problem writing to the HTTP cache: %s", e)
+
 
 class HTTPClient:
 
@@ -13,29 +204,148 @@ class HTTPClient:
     Client for interacting with HTTP
     """
 
-    def __init__(self, *, session=None, loop=asyncio.get_event_loop()):
+    def __init__(self, *, session=None, loop=None, pool_size=100, per_host=10, keepalive=30,
+                 dns_ttl=300, timeout=30, connect_timeout=10, read_timeout=20,
+                 cache_bytes=0, cache_dir=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.timeout = timeout or None
+        self.cache = ResponseCache(cache_bytes, directory=cache_dir, loop=self.loop) if cache_bytes else None
+
+        self._owns_session = session is None
         if session is None:
-            self.session = aiohttp.ClientSession(loop=loop)
+            connector = {'limit': pool_size, 'limit_per_host': per_host, 'keepalive_timeout': keepalive,
+                         'use_dns_cache': True, 'ttl_dns_cache': dns_ttl}
+            timeouts = {}
+            if hasattr(aiohttp, 'ClientTimeout'):
+                timeouts['timeout'] = aiohttp.ClientTimeout(
+                    total=self.timeout, connect=connect_timeout or None, sock_read=read_timeout or None)
+            else:
+                # Older versions take them separately, and the oldest have no read timeout
+                # (the total timeout is still applied around each request in _run)
+                connector['conn_timeout'] = connect_timeout or None
+                timeouts['read_timeout'] = read_timeout or None
+            if not accepts(aiohttp.TCPConnector, 'limit_per_host'):
+                # Before aiohttp 2.0 the limit is per host and the pool has none
+                connector['limit'] = per_host
+            connector = aiohttp.TCPConnector(loop=self.loop, **supported(aiohttp.TCPConnector, connector))
+            self.session = aiohttp.ClientSession(
+                connector=connector, loop=self.loop, **supported(aiohttp.ClientSession, timeouts))
         else:
             self.session = session
 
         self.headers = {'User-Agent': USER_AGENT}
 
+        # Pool usage
+        self.in_flight = 0
+        self.peak = 0
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+
+        self._inflight = {}  # request key -> future shared by identical GETs
+        self.coalesced = 0
+
+    async def close(self):
+        """
+        Closes the session if it was created by this client
+        """
+        if self._owns_session and not self.session.closed:
+            result = self.session.close()
+            if inspect.isawaitable(result):
+                await result
+            log.debug("Closed HTTP session")
+
+    def stats(self):
+        """
+        Returns the pool usage counters as a dict
+        """
+        return {
+            'in_flight': self.in_flight,
+            'peak': self.peak,
+            'requests': self.requests,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'coalesced': self.coalesced,
+        }
+
     async def request(self, method, url, json=False, **kwargs):
         """
         Makes a HTTP request
         DO NOT call this function yourself - use provided methods
         """
+        status, headers, content_type, body = await self.fetch(method, url, **kwargs)
+        return self.parse(content_type, body, json)
+
+    def parse(self, content_type, body, json=False):
+        """
+        Returns a response body as JSON if it is JSON, otherwise as str
+        """
+        if content_type == 'application/json' or json is True:
+            return jsonlib.loads(body)
+        return body
+
+    async def fetch(self, method, url, **kwargs):
+        """
+        Makes a HTTP request
+        Returns a tuple of (status, headers, content type, body)
+        """
+        return await self._run(method, url, self._fetch(method, url, **kwargs))
+
+    async def feed(self, url, parser, *, headers={}, chunk_size=65536, **kwargs):
+        """
+        Streams the body of a GET request into a parser off the event loop
+        Reading stops as soon as parser.feed_bytes returns True
+
+        Returns the parser
+        """
+        headers = {**self.headers, **headers}
+        await self._run('GET', url, self._feed(url, parser, chunk_size, headers=headers, **kwargs))
+        return parser
+
+    async def _feed(self, url, parser, chunk_size, **kwargs):
+        async with self.session.request('GET', url, **kwargs) as r:
+            log.debug("%s [%s] %s/%s", r.method, r.url, r.status, r.reason)
+            while True:
+                chunk = await r.content.read(chunk_size)
+                if not chunk:
+                    break
+                if await self.loop.run_in_executor(None, parser.feed_bytes, chunk):
+                    break
+
+    async def _run(self, method, url, coro):
+        self.requests += 1
+        self.in_flight += 1
+        if self.in_flight > self.peak:
+            self.peak = self.in_flight
+        start = time.perf_counter()
+        outcome = 'exception'
+        try:
+            result = await asyncio.wait_for(coro, self.timeout)
+            outcome = 'ok'
+            return result
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            self.timeouts += 1
+            log.warning("%s [%s] timed out", method, url)
+            raise
+        except aiohttp.ClientError:
+            outcome = 'error'
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            HTTP.labels(method, outcome).observe(time.perf_counter() - start)
+
+    async def _fetch(self, method, url, **kwargs):
         async with self.session.request(method, url, **kwargs) as r:
-            log.debug("{0.method} [{0.url}] {0.status}/{0.reason}".format(r))
-            if r.headers['Content-Type'] == 'application/json' or json is True:
-                return await r.json()
-            else:
-                return await r.text()
+            log.debug("%s [%s] %s/%s", r.method, r.url, r.status, r.reason)
+            return r.status, r.headers, content_type(r.headers), await r.text()
 
     async def get(self, url, *, headers={}, json=False, **kwargs):
         """
         Make a GET request
+        Identical requests already in flight are shared instead of being sent again
+        Responses are cached and revalidated when the cache is enabled
 
         Params
         ------
@@ -52,5 +362,59 @@ class HTTPClient:
             If result was not JSON, returns str
         """
         headers = {**self.headers, **headers}
-        r = await self.request('GET', url, headers=headers, **kwargs)
-        return r
+        if kwargs:
+            # Extra request options are not part of the key, so do not share
+            return await self._get(url, headers, json, **kwargs)
+
+        key = (cache_key(url, headers), json)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = self.loop.create_future()
+        try:
+            result = await self._get(url, headers, json)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved, in case nothing else was waiting
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    async def _get(self, url, headers, json, **kwargs):
+        if self.cache is None or kwargs:
+            # Request options like params can change the response but are not
+            # part of the cache key, so those requests are not cached
+            return await self.request('GET', url, headers=headers, json=json, **kwargs)
+
+        cache = self.cache
+        key = cache_key(url, headers)
+        entry = await cache.get(key)
+        if entry is not None:
+            if entry.fresh():
+                cache.hits += 1
+                cache.bytes_saved += len(entry.body)
+                return self.parse(entry.content_type, entry.body, json)
+            headers.update(entry.conditional_headers())
+
+        status, rheaders, content_type, body = await self.fetch('GET', url, headers=headers)
+        if status == 304 and entry is not None:
+            cache.revalidated += 1
+            cache.bytes_saved += len(entry.body)
+            entry.update(rheaders)
+            return self.parse(entry.content_type, entry.body, json)
+
+        cache.misses += 1
+        if status == 200 and 'no-store' not in cache_control(rheaders):
+            entry = CachedResponse(url, content_type, body, rheaders.get('ETag'),
+                                   rheaders.get('Last-Modified'), freshness(rheaders), key)
+            if entry.etag or entry.last_modified or entry.fresh():
+                cache.put(entry)
+        return self.parse(content_type, body, json)
@@ -0,0 +1,139 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+import discord
+
+from .utils import JsonStore
+
+log = logging.getLogger(__name__)
+
+BULK_LIMIT = 100  # most messages Discord allows in one bulk delete
+
+
+class DeletionScheduler:
+
+    """
+    Deletes messages after a delay using a single timer
+    Deletions due close together in a channel are grouped into bulk deletes
+    """
+
+    def __init__(self, bot, *, window=1.0, persist=None):
+        self.bot = bot
+        self.loop = bot.loop
+        self.window = window
+        self.store = JsonStore(persist, loop=self.loop) if persist else None
+
+        self._heap = []  # (due, seq, channel id, server id, message id)
+        self._pending = set()  # message ids in the heap
+        self._seq = itertools.count()
+        self._timer = None
+        self._timer_due = None
+        self._loaded = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, msg, delay):
+        """
+        Deletes a message after delay seconds
+        """
+        server = msg.server.id if msg.server else None
+        if msg.id in self._pending:
+            return
+        self._push(time.time() + delay, msg.channel.id, server, msg.id)
+        log.debug("Scheduled message ID %s to delete (%ss)", msg.id, delay)
+
+    async def load(self):
+        """
+        Schedules deletions that were pending when the bot last stopped
+        """
+        if self.store is None or self._loaded:
+            return
+        self._loaded = True
+        data = await self.store.load()
+        for message, (channel, server, due) in list(data.items()):
+            self._push(due, channel, server, message, save=False)
+        if data:
+            log.info("Resuming %s pending message deletions", len(data))
+
+    def _push(self, due, channel, server, message, save=True):
+        if message in self._pending:
+            return
+        self._pending.add(message)
+        heapq.heappush(self._heap, (due, next(self._seq), channel, server, message))
+        if save and self.store is not None:
+            self.store.set(message, [channel, server, due])
+        if self._timer_due is None or due < self._timer_due:
+            self._arm(due)
+
+    def _arm(self, due):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_due = due
+        self._timer = self.loop.call_at(self.loop.time() + max(due - time.time(), 0), self._fire)
+
+    def _fire(self):
+        self._timer = self._timer_due = None
+        # Anything due within the window is deleted now so it can be grouped
+        cutoff = time.time() + self.window
+        groups = {}
+        while self._heap and self._heap[0][0] <= cutoff:
+            _, _, channel, server, message = heapq.heappop(self._heap)
+            self._pending.discard(message)
+            groups.setdefault((channel, server), []).append(message)
+        for (channel, server), messages in groups.items():
+            asyncio.ensure_future(self._delete(channel, server, messages), loop=self.loop)
+        if self._heap:
+            self._arm(self._heap[0][0])
+
+    def _can_bulk(self, channel_id, server_id):
+        if server_id is None or not self.bot.user.bot:
+            return False
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return False
+        return channel.permissions_for(channel.server.me).manage_messages
+
+    async def _delete(self, channel, server, messages):
+        # Sent through the outbound queue like other deletions, so they are paced
+        # and recorded with the rest of the requests to Discord
+        http = self.bot.http
+        submit = self.bot.outbound.submit
+        done = []  # deleted or already gone, so no longer persisted
+        try:
+            single = messages
+            if len(messages) > 1 and self._can_bulk(channel, server):
+                single = []
+                for i in range(0, len(messages), BULK_LIMIT):
+                    chunk = messages[i:i + BULK_LIMIT]
+                    if len(chunk) == 1:
+                        single.extend(chunk)
+                        continue
+                    try:
+                        await submit('bulk_delete', channel, lambda c=chunk: http.delete_messages(channel, c, server))
+                    except discord.NotFound:
+                        pass
+                    except discord.HTTPException as e:
+                        # The whole request is rejected if any message is too old to
+                        # bulk delete, so each is tried on its own instead
+                        log.debug("Bulk delete failed in %s, deleting one at a time: %s", channel, e)
+                        single.extend(chunk)
+                        continue
+                    done.extend(chunk)
+            for m in single:
+                try:
+                    await submit('delete', channel, lambda m=m: http.delete_message(channel, m, server))
+                except discord.NotFound:
+                    pass
+                except discord.HTTPException as e:
+                    log.warning("Problem deleting message %s in %s: %s", m, channel, e)
+                    continue
+                done.append(m)
+            log.debug("Deleted %s of %s messages in %s", len(done), len(messages), channel)
+        finally:
+            if self.store is not None:
+                for m in done:
+                    self.store.remove(m)
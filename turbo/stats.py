@@ -0,0 +1,211 @@
+import time
+import asyncio
+import logging
+
+from . import tasks
+from .executor import offload
+
+log = logging.getLogger(__name__)
+
+COMPACT_CHUNK = 10000  # members copied before letting other tasks run
+VERIFY_ATTEMPTS = 3
+
+count = offload(tasks.count_members)
+
+
+class Stats:
+
+    """
+    Aggregate counters for the stats command
+    Kept current from member and server events instead of recounting
+    """
+
+    def __init__(self):
+        self.reset()
+        self._changes = 0  # bumped by every event, to tell if a recount is stale
+
+        # Command dispatch
+        self.commands = 0
+        self.dispatch_time = 0.0
+        self.dispatch_max = 0.0
+        self.since = time.monotonic()
+
+    def reset(self):
+        self._users = {}  # user id -> [members, has avatar, is bot]
+        self._servers = {}  # server id -> (requires 2fa, has emojis)
+
+        self.members = 0
+        self.users = 0
+        self.avatar_members = 0
+        self.avatar_users = 0
+        self.bot_members = 0
+        self.bot_users = 0
+
+        self.servers = 0
+        self.mfa_servers = 0
+        self.emoji_servers = 0
+
+    def build(self, servers):
+        """
+        Recounts everything in a single pass over the servers
+        """
+        self.reset()
+        for s in servers:
+            self.add_server(s)
+        log.debug("Counted %s members in %s servers", self.members, self.servers)
+
+    def snapshot(self):
+        """
+        Returns the current counters as a dict
+        """
+        return {
+            'members': self.members,
+            'users': self.users,
+            'avatar_members': self.avatar_members,
+            'avatar_users': self.avatar_users,
+            'bot_members': self.bot_members,
+            'bot_users': self.bot_users,
+            'servers': self.servers,
+            'mfa_servers': self.mfa_servers,
+            'emoji_servers': self.emoji_servers,
+        }
+
+    async def compact(self, servers):
+        """
+        Returns the servers in the form count takes
+        Yields to other tasks every COMPACT_CHUNK members
+        """
+        compacted = []
+        copied = 0
+        for s in list(servers):
+            compacted.append((s.id, s.mfa_level == 1, bool(s.emojis),
+                              [(m.id, bool(m.avatar), m.bot) for m in s.members]))
+            copied += len(s.members)
+            if copied >= COMPACT_CHUNK:
+                copied = 0
+                await asyncio.sleep(0)
+        return compacted
+
+    def load(self, totals, users, flags):
+        """
+        Replaces everything with a recount from count
+        """
+        self._users = users
+        self._servers = flags
+        for k, v in totals.items():
+            setattr(self, k, v)
+
+    async def verify(self, servers):
+        """
+        Recounts everything in the executor and returns the counters that had
+        drifted as a dict of name -> (previous, actual)
+        Events during the recount make it stale, so it is tried again, and done on
+        the event loop as a last resort
+        """
+        for _ in range(VERIFY_ATTEMPTS):
+            changes = self._changes
+            before = self.snapshot()
+            totals, users, flags = await count(await self.compact(servers))
+            if self._changes == changes:
+                break
+        else:
+            log.debug("Stats kept changing while being recounted, recounting on the event loop")
+            before = self.snapshot()
+            self.build(servers)
+            totals = self.snapshot()
+            users = None
+        drift = {k: (before[k], totals[k]) for k in totals if before[k] != totals[k]}
+        if drift:
+            log.warning("Stats had drifted: %s", drift)
+            if users is not None:
+                self.load(totals, users, flags)
+        return drift
+
+    def add_member(self, member):
+        self._changes += 1
+        u = self._users.get(member.id)
+        if u is None:
+            u = self._users[member.id] = [0, bool(member.avatar), member.bot]
+            self.users += 1
+            self.avatar_users += u[1]
+            self.bot_users += u[2]
+        u[0] += 1
+        self.members += 1
+        self.avatar_members += u[1]
+        self.bot_members += u[2]
+
+    def remove_member(self, member):
+        self._changes += 1
+        u = self._users.get(member.id)
+        if u is None:
+            return
+        u[0] -= 1
+        self.members -= 1
+        self.avatar_members -= u[1]
+        self.bot_members -= u[2]
+        if u[0] <= 0:
+            del self._users[member.id]
+            self.users -= 1
+            self.avatar_users -= u[1]
+            self.bot_users -= u[2]
+
+    def update_member(self, before, after):
+        self._changes += 1
+        u = self._users.get(after.id)
+        avatar = bool(after.avatar)
+        if u is None or u[1] == avatar:
+            return
+        diff = 1 if avatar else -1
+        u[1] = avatar
+        self.avatar_users += diff
+        self.avatar_members += diff * u[0]
+
+    def _server_flags(self, server):
+        return (server.mfa_level == 1, bool(server.emojis))
+
+    def add_server(self, server):
+        self._changes += 1
+        if server.id in self._servers:
+            return
+        flags = self._servers[server.id] = self._server_flags(server)
+        self.servers += 1
+        self.mfa_servers += flags[0]
+        self.emoji_servers += flags[1]
+        for m in server.members:
+            self.add_member(m)
+
+    def remove_server(self, server):
+        self._changes += 1
+        flags = self._servers.pop(server.id, None)
+        if flags is None:
+            return
+        self.servers -= 1
+        self.mfa_servers -= flags[0]
+        self.emoji_servers -= flags[1]
+        for m in server.members:
+            self.remove_member(m)
+
+    def update_server(self, server):
+        self._changes += 1
+        old = self._servers.get(server.id)
+        if old is None:
+            return
+        new = self._servers[server.id] = self._server_flags(server)
+        self.mfa_servers += new[0] - old[0]
+        self.emoji_servers += new[1] - old[1]
+
+    def record_command(self, elapsed):
+        """
+        Records how long a command took to dispatch, in seconds
+        """
+        self.commands += 1
+        self.dispatch_time += elapsed
+        if elapsed > self.dispatch_max:
+            self.dispatch_max = elapsed
+
+    def throughput(self):
+        """
+        Returns the commands dispatched per minute
+        """
+        minutes = (time.monotonic() - self.since) / 60
+        return self.commands / minutes if minutes else 0.0
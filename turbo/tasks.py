@@ -0,0 +1,116 @@
+"""
+Work that turbo sends to its executor
+
+This module only uses the standard library and doesn't import the rest of
+turbo, so process pool workers can import it without importing discord or
+setting up anything the bot needs
+"""
+import difflib
+import math
+import re
+
+TOKEN_RE = re.compile(r'\w+')
+
+TITLE_WEIGHT = 3  # a word in the title counts as much as this many in the body
+FUZZY_WEIGHT = 0.5  # score multiplier for words that only matched approximately
+K1 = 1.2
+B = 0.75
+
+
+def count_members(servers):
+    """
+    Counts servers given as (id, requires 2fa, has emojis, members) tuples, where
+    members are (id, has avatar, is bot) tuples
+    Returns the counters as a dict, user id -> [members, has avatar, is bot] and
+    server id -> (requires 2fa, has emojis)
+    """
+    users = {}
+    flags = {}
+    totals = dict.fromkeys((
+        'members', 'users', 'avatar_members', 'avatar_users', 'bot_members', 'bot_users',
+        'servers', 'mfa_servers', 'emoji_servers'), 0)
+    for id, mfa, emojis, members in servers:
+        if id in flags:
+            continue
+        flags[id] = (mfa, emojis)
+        totals['servers'] += 1
+        totals['mfa_servers'] += mfa
+        totals['emoji_servers'] += emojis
+        for member_id, avatar, bot in members:
+            u = users.get(member_id)
+            if u is None:
+                u = users[member_id] = [0, avatar, bot]
+                totals['users'] += 1
+                totals['avatar_users'] += avatar
+                totals['bot_users'] += bot
+            u[0] += 1
+            totals['members'] += 1
+            totals['avatar_members'] += u[1]
+            totals['bot_members'] += u[2]
+    return totals, users, flags
+
+
+def tokenize(text):
+    """Splits text into lowercase words"""
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def issue_terms(title, body):
+    """
+    Returns the weighted term frequencies of an issue's text
+    """
+    terms = {}
+    for t in tokenize(title):
+        terms[t] = terms.get(t, 0) + TITLE_WEIGHT
+    for t in tokenize(body):
+        terms[t] = terms.get(t, 0) + 1
+    return terms
+
+
+def analyse_issues(texts):
+    """
+    Returns the terms of (title, body) tuples, for a page of issues
+    """
+    return [issue_terms(title, body) for title, body in texts]
+
+
+def expand(postings, token):
+    """
+    Returns the indexed tokens matching a query token as (token, weight)
+    Falls back to prefix and close matches if there is no exact match
+    """
+    if token in postings:
+        return [(token, 1.0)]
+    matches = set(difflib.get_close_matches(token, postings, n=3, cutoff=0.8))
+    if len(token) >= 3:
+        matches.update(t for t in postings if t.startswith(token))
+    return [(t, FUZZY_WEIGHT) for t in matches]
+
+
+def rank_issues(issues, terms, lengths, postings, total_length, query, limit):
+    """
+    Ranks issues against a query with BM25, given the index of a repository's
+    issues (see turbo.github.RepoIssues)
+    Returns the numbers of the best matching issues, best first
+    """
+    n = len(issues)
+    if not n:
+        return []
+    avg = total_length / n or 1
+    scores = {}
+    for token in set(tokenize(query)):
+        for t, weight in expand(postings, token):
+            posting = postings[t]
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for number in posting:
+                tf = terms[number][t]
+                length = lengths[number]
+                score = weight * idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg))
+                scores[number] = scores.get(number, 0) + score
+
+    # Keep exact phrase matches in the title on top
+    query = query.lower()
+    for number in scores:
+        if query in (issues[number]['title'] or '').lower():
+            scores[number] *= 2
+    return sorted(scores, key=scores.get, reverse=True)[:limit]
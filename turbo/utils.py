@@ -1,13 +1,20 @@
+import asyncio
 import logging
 import os
 import configparser
 import ruamel.yaml as yaml
 import json
+import stat
+import tempfile
 
 from .exceptions import Shutdown
 
 log = logging.getLogger(__name__)
 
+# Read once, as it can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
 
 def load_json(file):
     """Loads a JSON file and returns it as a dict"""
@@ -21,6 +28,132 @@ def dump_json(file, array):
         return json.dump(array, f)
 
 
+def dump_json_atomic(file, array):
+    """Dumps a dict to a JSON file, replacing it only once fully written"""
+    directory = os.path.dirname(os.path.abspath(file))
+    try:
+        mode = stat.S_IMODE(os.stat(file).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK
+    fd, tmp = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=directory)
+    try:
+        # mkstemp makes the file private, keep the permissions of the file it replaces
+        os.chmod(tmp, mode)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(array, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, file)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class JsonStore:
+
+    """
+    Keeps a JSON file in memory, only reading it again when it changes on disk
+    The file is only saved once it has been loaded, so it can't be replaced by
+    the changes made before that
+    """
+
+    def __init__(self, filename, *, loop=None, save_delay=5):
+        self.filename = filename
+        self.loop = loop or asyncio.get_event_loop()
+        self.save_delay = save_delay
+        self.data = {}
+        self.loaded = False
+        self._pending = []  # (func, args) of changes made before loading, applied to the loaded data
+        self._mtime = None
+        self._save_handle = None
+
+    async def load(self):
+        """
+        Returns the file's data, reloading it off the event loop if it has changed
+        """
+        try:
+            mtime = os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError:
+            self._loaded()
+            return self.data
+        if mtime != self._mtime:
+            try:
+                data = await self.loop.run_in_executor(None, load_json, self.filename)
+            except ValueError as e:
+                log.error("Problem parsing {} as JSON: {}".format(self.filename, e))
+            else:
+                self.data = data
+                self._loaded()
+                log.debug("Loaded '{}'".format(self.filename))
+            self._mtime = mtime
+        return self.data
+
+    def _loaded(self):
+        for func, args in self._pending:
+            func(self.data, *args)
+        self._pending = []
+        self.loaded = True
+
+    async def save(self):
+        """
+        Writes the data to the file atomically, serialising off the event loop
+        """
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if not self.loaded:
+            await self.load()
+            if not self.loaded:
+                log.warning("Not saving {} as it could not be loaded".format(self.filename))
+                return
+        await self.loop.run_in_executor(None, dump_json_atomic, self.filename, dict(self.data))
+        # Our own write should not trigger a reload
+        self._mtime = os.stat(self.filename).st_mtime_ns
+        log.debug("Saved '{}'".format(self.filename))
+
+    def set(self, key, value):
+        """
+        Sets a key and schedules the file to be saved
+        """
+        self._change(dict.__setitem__, key, value)
+
+    def remove(self, key):
+        """
+        Removes a key and schedules the file to be saved
+        """
+        # Before loading, the key may only be in the file
+        if key in self.data or not self.loaded:
+            self._change(dict.pop, key, None)
+
+    def clear(self):
+        """
+        Removes every key and schedules the file to be saved
+        """
+        self._change(dict.clear)
+
+    def _change(self, func, *args):
+        func(self.data, *args)
+        if not self.loaded:
+            self._pending.append((func, args))
+        self.schedule_save()
+
+    def schedule_save(self):
+        """
+        Saves the file after save_delay, batching changes made in the meantime
+        """
+        if self._save_handle is None:
+            self._save_handle = self.loop.call_later(self.save_delay, self._save_later)
+
+    def _save_later(self):
+        self._save_handle = None
+        future = asyncio.ensure_future(self.save(), loop=self.loop)
+        future.add_done_callback(self._log_save_error)
+
+    def _log_save_error(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            log.error("Problem saving {}: {}".format(self.filename, future.exception()))
+
+
 class Config:
 
     """
@@ -67,10 +200,46 @@ class Config:
         self.selfbotmessageedit = config.getboolean('Advanced', 'SelfbotMessageEdit', fallback=True)
 
         self.dbtable_tags = config.get('Advanced', 'DbTable_Tags', fallback='tags')
+        self.dbtable_shards = config.get('Advanced', 'DbTable_Shards', fallback='shards')
 
         self.discrimrevert = config.getboolean('Advanced', 'DiscrimRevert', fallback=True)
         self.backuptags = config.getboolean('Advanced', 'BackupTags', fallback=True)
 
+        self.tagcachesize = config.getint('Advanced', 'TagCacheSize', fallback=1000)
+        self.tagcachebytes = config.getint('Advanced', 'TagCacheBytes', fallback=1048576)
+        self.tagcachettl = config.getint('Advanced', 'TagCacheTTL', fallback=0)
+        self.livetags = config.getboolean('Advanced', 'LiveTags', fallback=True)
+        self.persistdeletions = config.getboolean('Advanced', 'PersistDeletions', fallback=False)
+        self.mergereplies = config.getboolean('Advanced', 'MergeReplies', fallback=True)
+        self.maxcommands = config.getint('Advanced', 'MaxCommands', fallback=50)
+        self.subprocesstimeout = config.getint('Advanced', 'SubprocessTimeout', fallback=60)
+        self.subprocessmaxoutput = config.getint('Advanced', 'SubprocessMaxOutput', fallback=65536)
+        self.looplagwarning = config.getfloat('Advanced', 'LoopLagWarning', fallback=0.25)
+        self.executor = config.get('Advanced', 'Executor', fallback='thread').lower()
+        self.executorworkers = config.getint('Advanced', 'ExecutorWorkers', fallback=0)
+
+        # [HTTP]
+        self.http_poolsize = config.getint('HTTP', 'PoolSize', fallback=100)
+        self.http_perhost = config.getint('HTTP', 'PerHostLimit', fallback=10)
+        self.http_keepalive = config.getfloat('HTTP', 'KeepAlive', fallback=30)
+        self.http_dnsttl = config.getint('HTTP', 'DnsCacheTTL', fallback=300)
+        self.http_timeout = config.getfloat('HTTP', 'Timeout', fallback=30)
+        self.http_connecttimeout = config.getfloat('HTTP', 'ConnectTimeout', fallback=10)
+        self.http_readtimeout = config.getfloat('HTTP', 'ReadTimeout', fallback=20)
+        self.http_cachebytes = config.getint('HTTP', 'CacheBytes', fallback=4194304)
+        self.http_cachedir = config.get('HTTP', 'CacheDir', fallback='')
+
+        # [Metrics]
+        self.metrics = config.getboolean('Metrics', 'Enabled', fallback=False)
+        self.metrics_host = config.get('Metrics', 'Host', fallback='127.0.0.1')
+        self.metrics_port = config.getint('Metrics', 'Port', fallback=9108)
+
+        # [Logging]
+        self.log_filelevel = config.get('Logging', 'FileLevel', fallback='DEBUG').upper()
+        self.log_consolelevel = config.get('Logging', 'ConsoleLevel', fallback='DEBUG').upper()
+        self.log_maxbytes = config.getint('Logging', 'MaxBytes', fallback=5242880)
+        self.log_backups = config.getint('Logging', 'Backups', fallback=3)
+
         log.debug("Loaded '{}'".format(filename))
         self.validate()
 
@@ -82,6 +251,13 @@ class Config:
         if not self.token:
             log.critical('You must provide a token in the config')
             critical = True
+        for level in (self.log_filelevel, self.log_consolelevel):
+            if level not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
+                log.critical("'{}' is not a valid log level".format(level))
+                critical = True
+        if self.executor not in ('thread', 'process', 'inline'):
+            log.critical("'{}' is not a valid executor, use thread, process or inline".format(self.executor))
+            critical = True
         if critical:
             raise Shutdown()
 